@@ -1,7 +1,7 @@
 import pandas as pd
 import numpy as np
 
-from pypm import metrics, signals, data_io, simulation, optimization
+from pypm import metrics, signals, data_io, simulation, optimization, cache
 from pypm.optimization import GridSearchOptimizer
 
 from typing import List, Dict, Tuple, Callable
@@ -15,26 +15,29 @@ def bind_simulator(**sim_kwargs) -> Callable:
     symbols: List[str] = data_io.get_all_symbols()
     prices: pd.DataFrame = data_io.load_eod_matrix(symbols)
 
-    _bollinger: Callable = signals.create_bollinger_band_signal
+    _bollinger: Callable = cache.memoize(signals.create_bollinger_band_signal)
     bollinger_n = 20
 
     returns = metrics.calculate_return_series(prices)
     sharpe_n = 20
 
-    def bootstrap_rolling_sharpe_ratio(return_series: pd.Series) -> pd.Series:
-        _series = return_series.iloc[1:]
-        _series = _series.sample(n=return_series.shape[0], replace=True)
-        _series.iloc[:1] = [np.nan]
-        _series = pd.Series(_series.values, index=return_series.index)
-        _windowed_series = _series.rolling(sharpe_n)
-        return _windowed_series.mean() / _windowed_series.std()
+    def bootstrap_rolling_sharpe_ratio(returns: pd.DataFrame) -> pd.DataFrame:
+        # Resample every column's returns after the first, independently
+        _n = returns.shape[0]
+        _rows = np.random.randint(1, _n, size=returns.shape)
+        _values = np.take_along_axis(returns.values, _rows, axis=0)
+        _values[:1] = np.nan
+        _df = pd.DataFrame(_values, index=returns.index, 
+            columns=returns.columns)
+        _windowed_df = _df.rolling(sharpe_n)
+        return _windowed_df.mean() / _windowed_df.std()
 
     _sharpe: Callable = bootstrap_rolling_sharpe_ratio
 
     def _simulate(bootstrap_test_id: int) -> Performance:
         
-        signal = prices.apply(_bollinger, args=(bollinger_n,), axis=0)
-        preference = returns.apply(_sharpe, axis=0)
+        signal = _bollinger(prices, bollinger_n)
+        preference = _sharpe(returns)
 
         simulator = simulation.SimpleSimulator(**sim_kwargs)
         simulator.simulate(prices, signal, preference)
@@ -45,7 +48,11 @@ def bind_simulator(**sim_kwargs) -> Callable:
 
 if __name__ == '__main__':
 
-    simulate = bind_simulator(initial_cash=10000, max_active_positions=5)
+    simulate = bind_simulator(
+        initial_cash=10000,
+        max_active_positions=5,
+        metrics_only=True,
+    )
 
     optimizer = GridSearchOptimizer(simulate)
     optimizer.optimize(bootstrap_test_id=range(1000))
@@ -1,6 +1,6 @@
 import pandas as pd
 
-from pypm import metrics, signals, data_io, simulation, optimization
+from pypm import metrics, signals, data_io, simulation, optimization, cache
 from pypm.optimization import GridSearchOptimizer
 
 from typing import List, Dict, Tuple, Callable
@@ -16,13 +16,14 @@ def bind_simulator(**sim_kwargs) -> Callable:
     symbols: List[str] = data_io.get_all_symbols()
     prices: pd.DataFrame = data_io.load_eod_matrix(symbols)
 
-    _bollinger: Callable = signals.create_bollinger_band_signal
-    _sharpe: Callable = metrics.calculate_rolling_sharpe_ratio
+    # Each bollinger_n and sharpe_n recurs across the grid, compute them once
+    _bollinger: Callable = cache.memoize(signals.create_bollinger_band_signal)
+    _sharpe: Callable = cache.memoize(metrics.calculate_rolling_sharpe_ratio)
 
     def _simulate(bollinger_n: int, sharpe_n: int) -> Performance:
         
-        signal = prices.apply(_bollinger, args=(bollinger_n,), axis=0)
-        preference = prices.apply(_sharpe, args=(sharpe_n, ), axis=0)
+        signal = _bollinger(prices, bollinger_n)
+        preference = _sharpe(prices, sharpe_n)
 
         simulator = simulation.SimpleSimulator(**sim_kwargs)
         simulator.simulate(prices, signal, preference)
@@ -33,7 +34,11 @@ def bind_simulator(**sim_kwargs) -> Callable:
 
 if __name__ == '__main__':
 
-    simulate = bind_simulator(initial_cash=10000, max_active_positions=5)
+    simulate = bind_simulator(
+        initial_cash=10000,
+        max_active_positions=5,
+        metrics_only=True,
+    )
 
     optimizer = GridSearchOptimizer(simulate)
     optimizer.optimize(
@@ -0,0 +1,204 @@
+import os
+import pickle
+import hashlib
+import inspect
+import tempfile
+import functools
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+from typing import Any, Callable, Tuple, Dict
+
+
+def fingerprint(data: Any) -> str:
+    """
+    Hash of the contents of a series, dataframe, array or plain value. Equal
+    data gives the same fingerprint across runs and processes.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(type(data).__name__.encode())
+
+    if isinstance(data, (pd.Series, pd.DataFrame)):
+        # Vectorized row hashes cover the values and the index
+        row_hashes = pd.util.hash_pandas_object(data, index=True).values
+        digest.update(row_hashes.tobytes())
+        names = data.columns if isinstance(data, pd.DataFrame) else [data.name]
+        digest.update(repr(list(names)).encode())
+    elif isinstance(data, np.ndarray):
+        digest.update(repr((data.dtype.str, data.shape)).encode())
+        digest.update(np.ascontiguousarray(data).tobytes())
+    elif isinstance(data, (list, tuple)):
+        for item in data:
+            digest.update(fingerprint(item).encode())
+    else:
+        digest.update(repr(data).encode())
+
+    return digest.hexdigest()
+
+
+def _code_digest(code: Any, digest: Any):
+    """
+    Fold bytecode and constants into digest, recursing into nested code such 
+    as lambdas and comprehensions
+    """
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            _code_digest(const, digest)
+        elif isinstance(const, frozenset):
+            # Set order varies with string hash randomization
+            digest.update(repr(sorted(map(repr, const))).encode())
+        else:
+            digest.update(repr(const).encode())
+
+
+def _function_key(func: Callable, version: Any=None) -> str:
+    """
+    Identifies a function by name, bytecode and constants, so disk entries 
+    written by an older version of the function are not reused. Functions it 
+    calls are not tracked, pass a new version when one of them changes.
+    """
+    name = f'{func.__module__}.{func.__qualname__}|{version!r}'
+    digest = hashlib.blake2b(name.encode(), digest_size=16)
+    code = getattr(func, '__code__', None)
+    if code is not None:
+        _code_digest(code, digest)
+    return digest.hexdigest()
+
+
+class IndicatorCache(object):
+    """
+    Memoizes indicator and signal results keyed by the fingerprint of their
+    inputs, the function and its parameters. Keeps the max_entries most
+    recently used results in memory. If cache_dir is given, every result is
+    also pickled there and found again by later runs and other processes.
+
+    Cached results are shared between callers and must not be modified in
+    place.
+    """
+
+    def __init__(self, max_entries: int=32, cache_dir: str=None):
+        assert max_entries > 0, 'Cache must hold at least one entry'
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, func: Callable, args: Tuple, kwargs: Dict, 
+        version: Any=None) -> str:
+        # Bind to the signature so positional, keyword and default arguments 
+        # of the same call agree
+        try:
+            bound = inspect.signature(func).bind(*args, **kwargs)
+            bound.apply_defaults()
+            args, kwargs = (), bound.arguments
+        except (TypeError, ValueError):
+            pass
+
+        parts = [_function_key(func, version)]
+        parts += [fingerprint(arg) for arg in args]
+        parts += [f'{k}={fingerprint(v)}' for k, v in sorted(kwargs.items())]
+        return hashlib.blake2b('|'.join(parts).encode(),
+            digest_size=20).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.pkl')
+
+    def get(self, key: str, default: Any=None) -> Any:
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        if self.cache_dir is not None and os.path.isfile(self._path(key)):
+            with open(self._path(key), 'rb') as f:
+                value = pickle.load(f)
+            self._remember(key, value)
+            return value
+
+        return default
+
+    def put(self, key: str, value: Any):
+        self._remember(key, value)
+
+        if self.cache_dir is not None:
+            # Write then rename so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+
+    def _remember(self, key: str, value: Any):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries or (self.cache_dir is not None and
+            os.path.isfile(self._path(key)))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self, disk: bool=False):
+        """
+        Empty the in-memory tier, and the on-disk tier if disk is True
+        """
+        self._entries.clear()
+        if disk and self.cache_dir is not None:
+            for filename in os.listdir(self.cache_dir):
+                if filename.endswith('.pkl'):
+                    os.remove(os.path.join(self.cache_dir, filename))
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Return func(*args, **kwargs), computing it only on a cache miss
+        """
+        return self._call(self.make_key(func, args, kwargs), func, args, 
+            kwargs)
+
+    def _call(self, key: str, func: Callable, args: Tuple, 
+        kwargs: Dict) -> Any:
+        _missing = object()
+        value = self.get(key, _missing)
+        if value is not _missing:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = func(*args, **kwargs)
+        self.put(key, value)
+        return value
+
+
+# Shared by every memoized function that is not given its own cache
+DEFAULT_CACHE = IndicatorCache()
+
+
+def memoize(func: Callable, cache: IndicatorCache=None, 
+    version: Any=None) -> Callable:
+    """
+    Wrap an indicator or signal function so that repeat calls with equal data
+    and parameters return the cached result, e.g.
+
+    >>> _bollinger = memoize(signals.create_bollinger_band_signal)
+    >>> signal = _bollinger(prices, 20)
+
+    Edits to func itself invalidate its entries, edits to the functions it 
+    calls do not. Change version to invalidate them when using cache_dir.
+    """
+    _cache = DEFAULT_CACHE if cache is None else cache
+
+    @functools.wraps(func)
+    def _memoized(*args, **kwargs):
+        key = _cache.make_key(func, args, kwargs, version)
+        return _cache._call(key, func, args, kwargs)
+
+    _memoized.cache = _cache
+    return _memoized
@@ -0,0 +1,324 @@
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+
+from pypm.indicators import calculate_moving_statistics
+from pypm.signals import calculate_crossover_signal
+
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+# Sources are bound to a series, dataframe or 2-D array, all the same shape
+PriceData = Union[pd.Series, pd.DataFrame, np.ndarray]
+
+
+def _divide(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return a / b
+
+
+def _log(a: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.log(a)
+
+
+def _greater(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid='ignore'):
+        return np.greater(a, b).astype(np.int8)
+
+
+def _less(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid='ignore'):
+        return np.less(a, b).astype(np.int8)
+
+
+def _shift(a: np.ndarray, n: int) -> np.ndarray:
+    shifted = np.full_like(a, np.nan, dtype=float)
+    if n < a.shape[0]:
+        shifted[n:] = a[:a.shape[0]-n]
+    return shifted
+
+
+def _rolling_sum(a: np.ndarray, n: int) -> np.ndarray:
+    return pd.DataFrame(a).rolling(n).sum().values
+
+
+# Element-wise operations by name, taking input values then parameters
+_OPS: Dict[str, Callable] = {
+    'add': np.add,
+    'sub': np.subtract,
+    'mul': np.multiply,
+    'div': _divide,
+    'neg': np.negative,
+    'gt': _greater,
+    'lt': _less,
+    'log': _log,
+    'shift': _shift,
+    'rolling_sum': _rolling_sum,
+    'astype': lambda a, dtype: a.astype(dtype),
+    'crossover': calculate_crossover_signal,
+    'apply': lambda *values, func, kwargs: func(*values, **dict(kwargs)),
+}
+
+# Moving statistics of one input are computed for all windows in one pass
+_MOVING_STATISTICS_OPS = {'sma': 0, 'stdev': 1}
+
+
+class Node(object):
+    """
+    An indicator expression, created through an IndicatorGraph. Equal
+    expressions over the same inputs are the same node. Combine nodes and
+    numbers with +, -, *, /, unary -, < and >. Comparisons give int8 0 or 1.
+    """
+
+    __slots__ = ('graph', 'op', 'inputs', 'params', 'key')
+
+    def __init__(self, graph: 'IndicatorGraph', op: str,
+        inputs: Tuple['Node', ...], params: Tuple, key: Tuple):
+        self.graph = graph
+        self.op = op
+        self.inputs = inputs
+        self.params = params
+        self.key = key
+
+    def __repr__(self) -> str:
+        return f'Node({self.op}, params={dict(self.params)})'
+
+    def _binary(self, op: str, other: Any, reverse: bool=False) -> 'Node':
+        if not isinstance(other, Node):
+            other = self.graph.constant(other)
+        a, b = (other, self) if reverse else (self, other)
+        return self.graph.node(op, a, b)
+
+    def __add__(self, other):
+        return self._binary('add', other)
+
+    def __radd__(self, other):
+        return self._binary('add', other, reverse=True)
+
+    def __sub__(self, other):
+        return self._binary('sub', other)
+
+    def __rsub__(self, other):
+        return self._binary('sub', other, reverse=True)
+
+    def __mul__(self, other):
+        return self._binary('mul', other)
+
+    def __rmul__(self, other):
+        return self._binary('mul', other, reverse=True)
+
+    def __truediv__(self, other):
+        return self._binary('div', other)
+
+    def __rtruediv__(self, other):
+        return self._binary('div', other, reverse=True)
+
+    def __neg__(self):
+        return self.graph.node('neg', self)
+
+    def __gt__(self, other):
+        return self._binary('gt', other)
+
+    def __lt__(self, other):
+        return self._binary('lt', other)
+
+
+class IndicatorGraph(object):
+    """
+    Lazily declared indicators and signals over shared nodes. Nodes are
+    deduplicated by (op, inputs, params), so strategies that reuse SMA(20) or
+    the same stdev compute it once. evaluate() runs the nodes the requested
+    outputs need in topological order and frees each intermediate as soon as
+    its last consumer has run. All sma and stdev nodes of one input share a
+    single multi-window moving statistics pass.
+
+    >>> graph = IndicatorGraph()
+    >>> close = graph.source('close')
+    >>> outputs = {
+    ...     'bollinger': graph.bollinger_band_signal(close, 20),
+    ...     'macd': graph.macd_signal(close, 5, 34),
+    ...     'trend': graph.sma(close, 20) > graph.sma(close, 34),
+    ... }
+    >>> results = graph.evaluate(outputs, {'close': prices})
+    """
+
+    def __init__(self):
+        self._nodes: Dict[Tuple, Node] = dict()
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def node(self, op: str, *inputs: Node, **params) -> Node:
+        """
+        Return the node for op over inputs with params, creating it only if no
+        equal node exists
+        """
+        params = tuple(sorted(params.items()))
+        key = (op, tuple(id(x) for x in inputs), params)
+        if key not in self._nodes:
+            self._nodes[key] = Node(self, op, inputs, params, key)
+        return self._nodes[key]
+
+    def source(self, name: str) -> Node:
+        """
+        An input, bound to data by name in evaluate()
+        """
+        return self.node('source', name=name)
+
+    def constant(self, value: float) -> Node:
+        return self.node('constant', value=value)
+
+    def sma(self, x: Node, n: int) -> Node:
+        return self.node('sma', x, n=n)
+
+    def stdev(self, x: Node, n: int) -> Node:
+        return self.node('stdev', x, n=n)
+
+    def log(self, x: Node) -> Node:
+        return self.node('log', x)
+
+    def shift(self, x: Node, n: int=1) -> Node:
+        return self.node('shift', x, n=n)
+
+    def log_return(self, x: Node) -> Node:
+        return self.log(x / self.shift(x))
+
+    def rolling_sum(self, x: Node, n: int) -> Node:
+        return self.node('rolling_sum', x, n=n)
+
+    def apply(self, func: Callable, *inputs: Node, **kwargs) -> Node:
+        """
+        A custom node computing func(*input_values, **kwargs) on 2-D arrays,
+        deduplicated like any other
+        """
+        return self.node('apply', *inputs, func=func,
+            kwargs=tuple(sorted(kwargs.items())))
+
+    def macd_oscillator(self, x: Node, n1: int=5, n2: int=34) -> Node:
+        assert n1 < n2, f'n1 must be less than n2'
+        return self.sma(x, n1) - self.sma(x, n2)
+
+    def bollinger_bands(self, x: Node, n: int=20) -> Tuple[Node, Node, Node]:
+        """
+        Middle, upper and lower Bollinger bands
+        """
+        middle = self.sma(x, n)
+        stdev = self.stdev(x, n)
+        return middle, middle + 2 * stdev, middle - 2 * stdev
+
+    def bollinger_band_signal(self, x: Node, n: int=20) -> Node:
+        """
+        Same as signals.create_bollinger_band_signal
+        """
+        _, upper, lower = self.bollinger_bands(x, n)
+        return (x < lower) - (x > upper)
+
+    def macd_signal(self, x: Node, n1: int=5, n2: int=34) -> Node:
+        """
+        Same as signals.create_macd_signal
+        """
+        macd = self.macd_oscillator(x, n1, n2)
+        crossover = self.node('crossover', macd, self.sma(x, n2))
+        return self.node('astype', crossover, dtype=np.int8)
+
+    @staticmethod
+    def _order(outputs: List[Node]) -> List[Node]:
+        """
+        Nodes the outputs depend on, inputs before the nodes that use them
+        """
+        order, seen = list(), set()
+        for output in outputs:
+            stack = [(output, False)]
+            while stack:
+                node, expanded = stack.pop()
+                if expanded:
+                    order.append(node)
+                elif id(node) not in seen:
+                    seen.add(id(node))
+                    stack.append((node, True))
+                    stack.extend((x, False) for x in reversed(node.inputs))
+        return order
+
+    def evaluate(self, outputs: Union[Dict[str, Node], List[Node]],
+        data: Dict[str, PriceData]) -> Union[Dict[str, PriceData],
+        List[PriceData]]:
+        """
+        Compute the output nodes with sources bound to data by name. Returns
+        results in the same form as outputs, each wrapped like the data.
+        """
+        named = isinstance(outputs, dict)
+        output_nodes = list(outputs.values()) if named else list(outputs)
+        order = self._order(output_nodes)
+
+        # Count remaining consumers so intermediates can be freed early
+        consumers = defaultdict(int)
+        for node in order:
+            for x in node.inputs:
+                consumers[id(x)] += 1
+        for node in output_nodes:
+            consumers[id(node)] += 1
+
+        # Windows of every sma and stdev node, grouped by input
+        windows = defaultdict(set)
+        pending_statistics = defaultdict(int)
+        for node in order:
+            if node.op in _MOVING_STATISTICS_OPS:
+                windows[id(node.inputs[0])].add(dict(node.params)['n'])
+                pending_statistics[id(node.inputs[0])] += 1
+
+        template = None
+        values: Dict[int, np.ndarray] = dict()
+        statistics: Dict[int, Dict] = dict()
+
+        for node in order:
+            params = dict(node.params)
+            inputs = [values[id(x)] for x in node.inputs]
+
+            if node.op == 'source':
+                data_value = data[params['name']]
+                if template is None:
+                    template = data_value
+                assert np.shape(data_value) == np.shape(template), \
+                    'All sources must have the same shape'
+                value = np.asarray(data_value, dtype=float)
+                value = value.reshape(value.shape[0], -1)
+            elif node.op == 'constant':
+                value = np.asarray(params['value'])
+            elif node.op in _MOVING_STATISTICS_OPS:
+                source_id = id(node.inputs[0])
+                if source_id not in statistics:
+                    statistics[source_id] = calculate_moving_statistics(
+                        inputs[0], sorted(windows[source_id]))
+                pair = statistics[source_id][params['n']]
+                value = pair[_MOVING_STATISTICS_OPS[node.op]]
+                pending_statistics[source_id] -= 1
+                if pending_statistics[source_id] == 0:
+                    del statistics[source_id]
+            else:
+                value = _OPS[node.op](*inputs, **params)
+
+            values[id(node)] = value
+            for x in node.inputs:
+                consumers[id(x)] -= 1
+                if consumers[id(x)] == 0:
+                    del values[id(x)]
+
+        results = [self._wrap(values[id(node)], template)
+            for node in output_nodes]
+        if named:
+            return dict(zip(outputs.keys(), results))
+        return results
+
+    @staticmethod
+    def _wrap(value: np.ndarray, template: PriceData) -> PriceData:
+        # Constant outputs are broadcast to the shape of the data
+        shape = np.shape(template)
+        value = np.array(np.broadcast_to(value, 
+            (shape[0], int(np.prod(shape[1:])))))
+        if isinstance(template, pd.DataFrame):
+            return pd.DataFrame(value, index=template.index,
+                columns=template.columns)
+        if isinstance(template, pd.Series):
+            return pd.Series(value.ravel(), index=template.index,
+                name=template.name)
+        return value.reshape(shape)
@@ -1,6 +1,13 @@
+import numpy as np
 import pandas as pd
 from pypm.data_io import load_eod_data
 
+from typing import Dict, Iterable, Tuple, Union, Any
+
+# Indicators accept a single price series or a dataframe of them, one column 
+# per symbol
+PriceData = Union[pd.Series, pd.DataFrame]
+
 
 def calculate_simple_moving_average(series: pd.Series, n: int=20) -> pd.Series:
     """Calculates the simple moving average"""
@@ -12,6 +19,155 @@ def calculate_simple_moving_sample_stdev(series: pd.Series, n: int=20) -> pd.Ser
     return series.rolling(n).std()
 
 
+# Shortest block of rows the moving statistics restart their sums on
+_MIN_BLOCK_SIZE = 64
+
+
+def _calculate_moving_statistics(values: np.ndarray, 
+    windows: Iterable[int]) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Moving average and sample stdev of each column of a 2-D array for every 
+    window length, with pandas rolling semantics. Windows holding a NaN are 
+    NaN.
+
+    Cumulative sums restart on each block of rows, shifted by the block's 
+    first valid value, which leaves the variance unchanged but keeps the sums 
+    small, so the sum-of-squares formula does not cancel catastrophically 
+    even as prices drift over a long history. Blocks are at least as long as 
+    the longest window, so a window either lies in one block or joins the 
+    tail of the previous block, moved to this block's shift, to the head of 
+    this one. All of that is computed once, so each window only takes 
+    differences of the sums. Windows of a single repeated value are exact, as 
+    in pandas.
+    """
+    windows = list(windows)
+    length, width = values.shape
+
+    # Pad to whole blocks of rows, padding counts as NaN
+    block_size = max(windows + [_MIN_BLOCK_SIZE])
+    n_blocks = -(-length // block_size)
+    padded_length = n_blocks * block_size
+    padded = np.full((padded_length, width), np.nan)
+    padded[:length] = values
+    blocks = padded.reshape(n_blocks, block_size, width)
+    valid = ~np.isnan(blocks)
+
+    # Shift each block by its first valid value, 0 if it has none
+    first_valid = np.take_along_axis(blocks, 
+        valid.argmax(axis=1)[:, np.newaxis], axis=1)[:, 0]
+    shifts = np.where(np.isnan(first_valid), 0, first_valid)
+    shifted = np.where(valid, blocks - shifts[:, np.newaxis], 0)
+
+    # Sums over each block up to each row, after a leading zero row
+    sums = np.zeros((n_blocks, block_size + 1, width))
+    np.cumsum(shifted, axis=1, out=sums[:, 1:])
+    np.multiply(shifted, shifted, out=shifted)
+    squares = np.zeros((n_blocks, block_size + 1, width))
+    np.cumsum(shifted, axis=1, out=squares[:, 1:])
+    del shifted
+
+    # Sums from each row to the end of its block, moved to the next block's 
+    # shift, for the last rows that the longest window can reach back to
+    tail_length = max(windows + [1]) - 1
+    tail = slice(block_size - tail_length, block_size)
+    delta = (shifts[:-1] - shifts[1:])[:, np.newaxis]
+    count = np.arange(tail_length, 0, -1)[:, np.newaxis]
+    tail_sums = sums[:-1, -1:] - sums[:-1, tail]
+    tail_squares = squares[:-1, -1:] - squares[:-1, tail] + \
+        count * delta * delta
+    tail_squares += 2 * delta * tail_sums
+    tail_sums += count * delta
+
+    # Counts of NaN and of changes of value before each row. A window holding 
+    # a NaN is NaN, one without changes holds a single repeated value.
+    def _count(a: np.ndarray) -> np.ndarray:
+        counts = np.zeros((padded_length + 1, width), dtype=np.int32)
+        np.cumsum(a, axis=0, out=counts[1:])
+        return counts
+
+    nan_counts = _count(~valid.reshape(-1, width))
+    changes = np.ones((padded_length, width), dtype=bool)
+    np.not_equal(padded[1:], padded[:-1], out=changes[1:])
+    change_counts = _count(changes)
+    del changes
+
+    statistics = dict()
+    window_sum = np.empty((n_blocks, block_size, width))
+    window_squares = np.empty((n_blocks, block_size, width))
+    for n in windows:
+        if n > length:
+            mean = np.full((length, width), np.nan)
+            statistics[n] = (mean, mean.copy())
+            continue
+
+        # Windows within a block, then those joining the previous block. The 
+        # first block has no previous one, so its first windows are NaN.
+        inner = block_size - n + 1
+        np.subtract(sums[:, n:], sums[:, :inner], out=window_sum[:, n-1:])
+        np.subtract(squares[:, n:], squares[:, :inner], 
+            out=window_squares[:, n-1:])
+        np.add(sums[1:, 1:n], tail_sums[:, tail_length-n+1:], 
+            out=window_sum[1:, :n-1])
+        np.add(squares[1:, 1:n], tail_squares[:, tail_length-n+1:], 
+            out=window_squares[1:, :n-1])
+        window_sum[0, :n-1] = np.nan
+
+        # Sample variance as (squares - sum^2 / n) / (n - 1)
+        stdev = np.multiply(window_sum, window_sum)
+        stdev *= -1 / n
+        stdev += window_squares
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stdev /= n - 1
+        np.maximum(stdev, 0, out=stdev)
+        np.sqrt(stdev, out=stdev)
+
+        mean = np.divide(window_sum, n)
+        mean += shifts[:, np.newaxis]
+        mean = mean.reshape(-1, width)
+        stdev = stdev.reshape(-1, width)
+
+        # Windows of one repeated value are exact, windows with NaN are NaN
+        changed = change_counts[n:] - change_counts[1:padded_length-n+2]
+        is_constant = changed == 0
+        is_nan = (nan_counts[n:] - nan_counts[:-n]) > 0
+        np.copyto(mean[n-1:], padded[n-1:], where=is_constant)
+        np.copyto(stdev[n-1:], 0, where=is_constant)
+        np.copyto(mean[n-1:], np.nan, where=is_nan)
+        np.copyto(stdev[n-1:], np.nan, where=is_nan)
+        if n == 1:
+            stdev[:] = np.nan
+
+        statistics[n] = (mean[:length], stdev[:length])
+    return statistics
+
+
+def _wrap_like(values: np.ndarray, 
+    prices: Union[PriceData, np.ndarray]) -> Union[PriceData, np.ndarray]:
+    if isinstance(prices, np.ndarray):
+        return values.reshape(prices.shape)
+    if isinstance(prices, pd.DataFrame):
+        return pd.DataFrame(values, index=prices.index, columns=prices.columns)
+    return pd.Series(values.ravel(), index=prices.index, name=prices.name)
+
+
+def calculate_moving_statistics(prices: Union[PriceData, np.ndarray], 
+    windows: Iterable[int]) -> Dict[int, Tuple[Any, Any]]:
+    """
+    Calculates the simple moving average and sample stdev of a price series 
+    or a whole price matrix for several window lengths at once, from a single 
+    cumulative sum pass. Returns {n: (sma, stdev)} for each n in windows, 
+    matching calculate_simple_moving_average and 
+    calculate_simple_moving_sample_stdev. Numpy arrays, one column per 
+    symbol if 2-D, give arrays of the same shape without copying to pandas.
+    """
+    values = np.asarray(prices, dtype=float).reshape(prices.shape[0], -1)
+    statistics = _calculate_moving_statistics(values, windows)
+    return {
+        n: (_wrap_like(mean, prices), _wrap_like(stdev, prices))
+        for n, (mean, stdev) in statistics.items()
+    }
+
+
 def calculate_macd_oscillator(series: pd.Series,
     n1: int=5, n2: int=34) -> pd.Series:
     """
@@ -58,6 +214,281 @@ def calculate_chaikin_money_flow(df: pd.DataFrame, n: int=20) -> pd.Series:
     """
     return calculate_money_flow_volume(df, n) / df['volume'].rolling(n).sum()
 
+class StreamingIndicator(object):
+    """
+    Base for indicators that update one bar at a time for a whole vector of 
+    symbols, in constant time per symbol. Each update takes one value per 
+    symbol, NaN where a symbol has no data, and returns the indicator as of 
+    that bar, matching the last row of the batch function on every bar seen.
+
+    Constructors take the number of symbols first, then window lengths with 
+    the same defaults as the batch function.
+
+    snapshot() captures the full state, e.g. before a tentative bar, and 
+    restore() returns to it.
+    """
+
+    __slots__ = ()
+
+    # Names of mutable state attributes, arrays are copied on snapshot
+    _STATE_ATTRS: Tuple[str, ...] = ()
+
+    def snapshot(self) -> Dict[str, Any]:
+        state = dict()
+        for attr in self._STATE_ATTRS:
+            value = getattr(self, attr)
+            if isinstance(value, StreamingIndicator):
+                value = value.snapshot()
+            elif isinstance(value, np.ndarray):
+                value = value.copy()
+            state[attr] = value
+        return state
+
+    def restore(self, state: Dict[str, Any]):
+        for attr in self._STATE_ATTRS:
+            value = getattr(self, attr)
+            if isinstance(value, StreamingIndicator):
+                value.restore(state[attr])
+            elif isinstance(value, np.ndarray):
+                setattr(self, attr, state[attr].copy())
+            else:
+                setattr(self, attr, state[attr])
+
+
+class StreamingRollingSum(StreamingIndicator):
+    """
+    Trailing sum of the last n values of each symbol, as 
+    pd.DataFrame.rolling(n).sum(). Windows holding a NaN or infinite value are 
+    NaN.
+
+    A ring buffer holds the window. The running sum adds the new value and 
+    drops the oldest, and is recomputed from the buffer once every n bars so 
+    rounding errors cannot accumulate.
+    """
+
+    __slots__ = ('n', '_buffer', '_position', '_count', '_total', 
+        '_invalid_counts')
+
+    _STATE_ATTRS = ('_buffer', '_position', '_count', '_total', 
+        '_invalid_counts')
+
+    def __init__(self, n_symbols: int, n: int=20):
+        self.n = n
+        self._buffer = np.zeros((n, n_symbols))
+        self._position = 0
+        self._count = 0
+        self._total = np.zeros(n_symbols)
+        self._invalid_counts = np.zeros(n_symbols, dtype=np.int64)
+
+    def update(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=float)
+        invalid = ~np.isfinite(values)
+        values = np.where(invalid, 0, values)
+
+        # Swap the oldest value in the window for the new one
+        oldest = self._buffer[self._position]
+        if self._count >= self.n:
+            oldest_invalid = np.isnan(oldest)
+            self._total -= np.where(oldest_invalid, 0, oldest)
+            self._invalid_counts -= oldest_invalid
+        self._buffer[self._position] = np.where(invalid, np.nan, values)
+        self._total += values
+        self._invalid_counts += invalid
+
+        self._position = (self._position + 1) % self.n
+        self._count += 1
+        if self._position == 0:
+            self._total = np.nansum(self._buffer, axis=0)
+
+        return self.value
+
+    @property
+    def is_ready(self) -> bool:
+        return self._count >= self.n
+
+    @property
+    def value(self) -> np.ndarray:
+        if not self.is_ready:
+            return np.full_like(self._total, np.nan)
+        return np.where(self._invalid_counts > 0, np.nan, self._total)
+
+
+class StreamingMovingStatistics(StreamingIndicator):
+    """
+    Streaming counterpart of calculate_moving_statistics for a single window 
+    length. update() returns the simple moving average and the sample stdev.
+
+    Running sums are kept of values minus a per-symbol shift. Once every n 
+    bars the shift moves to the mean of the current window and the sums are 
+    recomputed from the ring buffer, so the sum-of-squares formula stays well 
+    conditioned however far prices travel. Windows of a single repeated value 
+    are exact, as in the batch version.
+    """
+
+    __slots__ = ('n', '_buffer', '_position', '_count', '_shift', '_sum', 
+        '_sum_of_squares', '_nan_counts', '_last', '_run_lengths')
+
+    _STATE_ATTRS = ('_buffer', '_position', '_count', '_shift', '_sum', 
+        '_sum_of_squares', '_nan_counts', '_last', '_run_lengths')
+
+    def __init__(self, n_symbols: int, n: int=20):
+        self.n = n
+        self._buffer = np.full((n, n_symbols), np.nan)
+        self._position = 0
+        self._count = 0
+        self._shift = np.full(n_symbols, np.nan)
+        self._sum = np.zeros(n_symbols)
+        self._sum_of_squares = np.zeros(n_symbols)
+        self._nan_counts = np.zeros(n_symbols, dtype=np.int64)
+        self._last = np.full(n_symbols, np.nan)
+        self._run_lengths = np.zeros(n_symbols, dtype=np.int64)
+
+    def _add(self, values: np.ndarray, sign: int):
+        deviations = values - self._shift
+        valid = ~np.isnan(deviations)
+        deviations = np.where(valid, deviations, 0)
+        self._sum += sign * deviations
+        self._sum_of_squares += sign * deviations * deviations
+        self._nan_counts += sign * np.isnan(values)
+
+    def _recenter(self):
+        counts = (~np.isnan(self._buffer)).sum(axis=0)
+        totals = np.nansum(self._buffer, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self._shift = np.where(counts > 0, totals / counts, self._shift)
+        deviations = self._buffer - self._shift
+        self._sum = np.nansum(deviations, axis=0)
+        self._sum_of_squares = np.nansum(deviations * deviations, axis=0)
+
+    def update(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        values = np.asarray(values, dtype=float)
+
+        # Swap the oldest value in the window for the new one
+        if self._count >= self.n:
+            self._add(self._buffer[self._position], -1)
+        first = np.isnan(self._shift) & ~np.isnan(values)
+        self._shift[first] = values[first]
+        self._add(values, 1)
+        self._buffer[self._position] = values
+
+        self._position = (self._position + 1) % self.n
+        self._count += 1
+        if self._position == 0:
+            self._recenter()
+
+        # Length of the run of repeated values ending on this bar
+        self._run_lengths = np.where(values == self._last, 
+            self._run_lengths + 1, 1)
+        self._last = values
+
+        n = self.n
+        mean = np.full_like(values, np.nan)
+        stdev = np.full_like(values, np.nan)
+        if self._count < n:
+            return mean, stdev
+
+        is_nan = self._nan_counts > 0
+        is_constant = self._run_lengths >= n
+        window_mean = self._sum / n
+        mean = np.where(is_constant, values, window_mean + self._shift)
+        mean[is_nan] = np.nan
+        if n > 1:
+            squares = self._sum_of_squares - self._sum * window_mean
+            variance = squares / (n - 1)
+            stdev = np.sqrt(np.where(is_constant, 0, np.maximum(variance, 0)))
+            stdev[is_nan] = np.nan
+
+        return mean, stdev
+
+
+class StreamingSimpleMovingAverage(StreamingIndicator):
+    """
+    Streaming calculate_simple_moving_average
+    """
+
+    __slots__ = ('_statistics',)
+    _STATE_ATTRS = ('_statistics',)
+
+    def __init__(self, n_symbols: int, n: int=20):
+        self._statistics = StreamingMovingStatistics(n_symbols, n)
+
+    def update(self, values: np.ndarray) -> np.ndarray:
+        mean, _ = self._statistics.update(values)
+        return mean
+
+
+class StreamingMovingSampleStdev(StreamingIndicator):
+    """
+    Streaming calculate_simple_moving_sample_stdev
+    """
+
+    __slots__ = ('_statistics',)
+    _STATE_ATTRS = ('_statistics',)
+
+    def __init__(self, n_symbols: int, n: int=20):
+        self._statistics = StreamingMovingStatistics(n_symbols, n)
+
+    def update(self, values: np.ndarray) -> np.ndarray:
+        _, stdev = self._statistics.update(values)
+        return stdev
+
+
+class StreamingBollingerBands(StreamingIndicator):
+    """
+    Streaming calculate_bollinger_bands. update() returns the middle, upper 
+    and lower bands.
+    """
+
+    __slots__ = ('_statistics',)
+    _STATE_ATTRS = ('_statistics',)
+
+    def __init__(self, n_symbols: int, n: int=20):
+        self._statistics = StreamingMovingStatistics(n_symbols, n)
+
+    def update(self, values: np.ndarray) -> Tuple[np.ndarray, ...]:
+        middle, stdev = self._statistics.update(values)
+        return middle, middle + 2 * stdev, middle - 2 * stdev
+
+
+class StreamingMacdOscillator(StreamingIndicator):
+    """
+    Streaming calculate_macd_oscillator
+    """
+
+    __slots__ = ('_short', '_long')
+    _STATE_ATTRS = ('_short', '_long')
+
+    def __init__(self, n_symbols: int, n1: int=5, n2: int=34):
+        assert n1 < n2, f'n1 must be less than n2'
+        self._short = StreamingSimpleMovingAverage(n_symbols, n1)
+        self._long = StreamingSimpleMovingAverage(n_symbols, n2)
+
+    def update(self, values: np.ndarray) -> np.ndarray:
+        return self._short.update(values) - self._long.update(values)
+
+
+class StreamingChaikinMoneyFlow(StreamingIndicator):
+    """
+    Streaming calculate_chaikin_money_flow, updated with the high, low, close 
+    and volume of each symbol
+    """
+
+    __slots__ = ('_money_flow_volume', '_volume')
+    _STATE_ATTRS = ('_money_flow_volume', '_volume')
+
+    def __init__(self, n_symbols: int, n: int=20):
+        self._money_flow_volume = StreamingRollingSum(n_symbols, n)
+        self._volume = StreamingRollingSum(n_symbols, n)
+
+    def update(self, high: np.ndarray, low: np.ndarray, close: np.ndarray, 
+        volume: np.ndarray) -> np.ndarray:
+        high, low, close, volume = (np.asarray(a, dtype=float) 
+            for a in (high, low, close, volume))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mfv = volume * (2*close - high - low) / (high - low)
+            return self._money_flow_volume.update(mfv) / \
+                self._volume.update(volume)
+
 
 if __name__ == '__main__':
     data = load_eod_data('AWU')
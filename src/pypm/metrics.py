@@ -1,10 +1,47 @@
 import numpy as np
 import pandas as pd
 from pypm.data_io import load_eod_data, load_spy_data
-from sklearn.linear_model import LinearRegression
-from typing import Dict, Any, Callable
+from typing import Dict, Any, Callable, Union, Tuple, Iterable, Iterator
 
-def calculate_return_series(series: pd.Series) -> pd.Series:
+# Most metrics accept either a single date-indexed series or a dataframe of 
+# many series sharing a date index, e.g. the equity curves of an optimizer 
+# sweep. Dataframes are computed column-wise in a single numpy operation and 
+# give one value per column.
+PriceData = Union[pd.Series, pd.DataFrame]
+MetricValue = Union[float, pd.Series]
+
+
+def _wrap_like(values: np.ndarray, series: PriceData) -> PriceData:
+    """
+    Wrap an array of the same shape as series in the same pandas type
+    """
+    if isinstance(series, pd.DataFrame):
+        return pd.DataFrame(values, index=series.index, columns=series.columns)
+    return pd.Series(values, index=series.index, name=series.name)
+
+
+def _wrap_reduced(values: np.ndarray, series: PriceData) -> MetricValue:
+    """
+    Wrap a column-wise reduction of series, a scalar for a single series and a 
+    series indexed by column for a dataframe
+    """
+    if isinstance(series, pd.DataFrame):
+        return pd.Series(values, index=series.columns)
+    return values[()]
+
+
+def _shifted_ratio(series: PriceData) -> np.ndarray:
+    """
+    Ratio of each value to the previous one, NaN for the first row
+    """
+    values = np.asarray(series, dtype=float)
+    ratio = np.full_like(values, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio[1:] = values[1:] / values[:-1]
+    return ratio
+
+
+def calculate_return_series(series: PriceData) -> PriceData:
     """
     Calculates the return series of a given time series.
 
@@ -14,20 +51,18 @@ def calculate_return_series(series: pd.Series) -> pd.Series:
 
     The first value will always be NaN.
     """
-
-    shifted_series = series.shift(1, axis=0)
-    return series / shifted_series - 1
+    return _wrap_like(_shifted_ratio(series) - 1, series)
 
 
-def calculate_log_return_series(series: pd.Series) -> pd.Series:
+def calculate_log_return_series(series: PriceData) -> PriceData:
     """
     Same as calculate_return_series but with log returns
     """
-    shifted_series = series.shift(1, axis=0)
-    return pd.Series(np.log(series / shifted_series))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _wrap_like(np.log(_shifted_ratio(series)), series)
 
 
-def calculate_percent_return(series: pd.Series) -> float:
+def calculate_percent_return(series: PriceData) -> MetricValue:
     """
     Takes the first and last value in a series to determine the percent return, 
     assuming the series is in date-ascending order
@@ -35,61 +70,117 @@ def calculate_percent_return(series: pd.Series) -> float:
     return series.iloc[-1] / series.iloc[0] - 1
 
 
-def get_years_past(series: pd.Series) -> float:
+SECONDS_PER_YEAR = 365.25 * 24 * 60 * 60
+
+
+def _years_between(start: Any, end: Any) -> Any:
+    """
+    Years from start to end, measured to the second so that intraday indexes 
+    annualize correctly. Works on timestamps and on date indexes.
+    """
+    return (end - start).total_seconds() / SECONDS_PER_YEAR
+
+
+class MetricsContext(object):
+    """
+    The facts about a date index that annualized metrics need: the number of 
+    periods, the years spanned, and the periods per year. Build one per index 
+    and pass it as context= to skip rescanning the index on every metric call.
+
+    Periods per year are observed from the index unless periods_per_year is 
+    given, e.g. 252 for a trading-day convention. Years past always follow 
+    the calendar.
+    """
+
+    __slots__ = ['n_periods', 'years_past', 'periods_per_year']
+
+    def __init__(self, index: pd.DatetimeIndex, 
+        periods_per_year: float=None):
+        self.n_periods = len(index)
+        self.years_past = _years_between(index[0], index[-1])
+        self.periods_per_year = periods_per_year
+
+    @property
+    def entries_per_year(self) -> float:
+        # Observed only when needed, an index of one timestamp spans no time
+        if self.periods_per_year is not None:
+            return self.periods_per_year
+        return self.n_periods / self.years_past
+
+    @property
+    def annualizer(self) -> float:
+        """
+        Scales a per-period standard deviation to an annual one
+        """
+        return np.sqrt(self.entries_per_year)
+
+
+def _get_context(series: PriceData, context: MetricsContext) -> MetricsContext:
+    return MetricsContext(series.index) if context is None else context
+
+
+def get_years_past(series: PriceData, context: MetricsContext=None) -> float:
     """
     Calculate the years past according to the index of the series for use with
     functions that require annualization   
     """
-    start_date = series.index[0]
-    end_date = series.index[-1]
-    return (end_date - start_date).days / 365.25
+    return _get_context(series, context).years_past
 
 
-def calculate_cagr(series: pd.Series) -> float:
+def calculate_cagr(series: PriceData, 
+    context: MetricsContext=None) -> MetricValue:
     """
     Calculate compounded annual growth rate
     """
     start_price = series.iloc[0]
     end_price = series.iloc[-1]
     value_factor = end_price / start_price
-    year_past = get_years_past(series)
+    year_past = get_years_past(series, context)
     return (value_factor ** (1 / year_past)) - 1
 
 
-def calculate_annualized_volatility(return_series: pd.Series) -> float:
+def calculate_annualized_volatility(return_series: PriceData, 
+    context: MetricsContext=None) -> MetricValue:
     """
     Calculates annualized volatility for a date-indexed return series. 
     Works for any interval of date-indexed prices and returns.
     """
-    years_past = get_years_past(return_series)
-    entries_per_year = return_series.shape[0] / years_past
-    return return_series.std() * np.sqrt(entries_per_year)
+    context = _get_context(return_series, context)
+    values = np.asarray(return_series, dtype=float)
+    stdev = np.nanstd(values, axis=0, ddof=1)
+    return _wrap_reduced(stdev * context.annualizer, return_series)
 
 
-def calculate_sharpe_ratio(price_series: pd.Series, 
-    benchmark_rate: float=0) -> float:
+def calculate_sharpe_ratio(price_series: PriceData, 
+    benchmark_rate: float=0, context: MetricsContext=None) -> MetricValue:
     """
     Calculates the Sharpe ratio given a price series. Defaults to benchmark_rate
     of zero.
     """
-    cagr = calculate_cagr(price_series)
+    context = _get_context(price_series, context)
+    cagr = calculate_cagr(price_series, context)
     return_series = calculate_return_series(price_series)
-    volatility = calculate_annualized_volatility(return_series)
+    volatility = calculate_annualized_volatility(return_series, context)
     return (cagr - benchmark_rate) / volatility
 
 
-def calculate_rolling_sharpe_ratio(price_series: pd.Series,
-    n: float=20) -> pd.Series:
+def calculate_rolling_sharpe_ratio(price_series: Union[PriceData, np.ndarray],
+    n: float=20) -> Union[PriceData, np.ndarray]:
     """
     Compute an approximation of the Sharpe ratio on a rolling basis. 
-    Intended for use as a preference value.
+    Intended for use as a preference value. Accepts a whole price matrix, as a 
+    dataframe or 2-D array, and computes every column at once.
     """
+    if isinstance(price_series, np.ndarray):
+        price_frame = pd.DataFrame(price_series)
+        return calculate_rolling_sharpe_ratio(price_frame, n).values
+
     rolling_return_series = calculate_return_series(price_series).rolling(n)
     return rolling_return_series.mean() / rolling_return_series.std()
 
 
-def calculate_annualized_downside_deviation(return_series: pd.Series,
-    benchmark_rate: float=0) -> float:
+def calculate_annualized_downside_deviation(return_series: PriceData,
+    benchmark_rate: float=0, context: MetricsContext=None) -> MetricValue:
     """
     Calculates the downside deviation for use in the Sortino ratio.
 
@@ -98,65 +189,149 @@ def calculate_annualized_downside_deviation(return_series: pd.Series,
     """
 
     # For both de-annualizing the benchmark rate and annualizing result
-    years_past = get_years_past(return_series)
-    entries_per_year = return_series.shape[0] / years_past
+    context = _get_context(return_series, context)
+    entries_per_year = context.entries_per_year
 
     adjusted_benchmark_rate = ((1+benchmark_rate) ** (1/entries_per_year)) - 1
 
-    downside_series = adjusted_benchmark_rate - return_series
-    downside_sum_of_squares = (downside_series[downside_series > 0] ** 2).sum()
+    values = np.asarray(return_series, dtype=float)
+    downside = adjusted_benchmark_rate - values
+    downside_squares = np.where(downside > 0, downside ** 2, 0)
+    downside_sum_of_squares = downside_squares.sum(axis=0)
     denominator = return_series.shape[0] - 1
     downside_deviation = np.sqrt(downside_sum_of_squares / denominator)
 
-    return downside_deviation * np.sqrt(entries_per_year)
+    annualized = downside_deviation * context.annualizer
+    return _wrap_reduced(annualized, return_series)
 
 
-def calculate_sortino_ratio(price_series: pd.Series,
-    benchmark_rate: float=0) -> float:
+def calculate_sortino_ratio(price_series: PriceData,
+    benchmark_rate: float=0, context: MetricsContext=None) -> MetricValue:
     """
     Calculates the Sortino ratio.
     """
-    cagr = calculate_cagr(price_series)
+    context = _get_context(price_series, context)
+    cagr = calculate_cagr(price_series, context)
     return_series = calculate_return_series(price_series)
-    downside_deviation = calculate_annualized_downside_deviation(return_series)
+    downside_deviation = calculate_annualized_downside_deviation(
+        return_series, context=context)
     return (cagr - benchmark_rate) / downside_deviation
 
 
-def calculate_pure_profit_score(price_series: pd.Series) -> float:
+def _fit_least_squares(x: np.ndarray, 
+    y: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Calculates the pure profit score
+    Closed-form simple linear regression of each column of y on x, ignoring 
+    rows where either is NaN. x is either 1-D or the same shape as y. Returns 
+    the intercept, slope and r-squared of each column.
     """
-    cagr = calculate_cagr(price_series)
+    if y.ndim == 2 and x.ndim == 1:
+        x = x[:, np.newaxis]
+    x, y = np.broadcast_arrays(x, y)
+    mask = ~(np.isnan(x) | np.isnan(y))
+    n = mask.sum(axis=0)
+
+    # Center before taking sums of squares for numerical stability
+    x_mean = np.where(mask, x, 0).sum(axis=0) / n
+    y_mean = np.where(mask, y, 0).sum(axis=0) / n
+    dx = np.where(mask, x - x_mean, 0)
+    dy = np.where(mask, y - y_mean, 0)
 
-    # Build a single column for a predictor, t
-    t: np.ndarray = np.arange(0, price_series.shape[0]).reshape(-1, 1)
+    sxx = (dx * dx).sum(axis=0)
+    sxy = (dx * dy).sum(axis=0)
+    syy = (dy * dy).sum(axis=0)
 
-    # Fit the regression
-    regression = LinearRegression().fit(t, price_series)
+    slope = sxy / sxx
+    intercept = y_mean - slope * x_mean
 
-    # Get the r-squared value
-    r_squared = regression.score(t, price_series)
+    # A constant y is fit perfectly, as in sklearn
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_squared = np.where(syy == 0, 1.0, sxy ** 2 / (sxx * syy))
 
-    return cagr * r_squared
+    return intercept, slope, r_squared
 
-def calculate_jensens_alpha(return_series: pd.Series, 
-    benchmark_return_series: pd.Series) -> float: 
+
+def calculate_pure_profit_score(price_series: PriceData, 
+    context: MetricsContext=None) -> MetricValue:
+    """
+    Calculates the pure profit score
+    """
+    cagr = calculate_cagr(price_series, context)
+
+    # Regress prices on a single predictor, t
+    t = np.arange(0, price_series.shape[0], dtype=float)
+    prices = np.asarray(price_series, dtype=float)
+    _, _, r_squared = _fit_least_squares(t, prices)
+
+    return cagr * _wrap_reduced(r_squared, price_series)
+
+def calculate_jensens_alpha(return_series: PriceData, 
+    benchmark_return_series: pd.Series) -> MetricValue: 
     """
     Calculates Jensen's alpha. Prefers input series have the same index. Handles
     NAs.
     """
 
-    # Join series along date index and purge NAs
-    df = pd.concat([return_series, benchmark_return_series], sort=True, axis=1)
-    df = df.dropna()
+    # Join series along date index, NAs are masked in the regression
+    index = return_series.index.union(benchmark_return_series.index)
+    returns = np.asarray(return_series.reindex(index), dtype=float)
+    benchmarks = np.asarray(benchmark_return_series.reindex(index), dtype=float)
+
+    alpha, _, _ = _fit_least_squares(benchmarks, returns)
+    return _wrap_reduced(alpha, return_series)
+
+def calculate_rolling_benchmark_statistics(return_series: pd.Series,
+    benchmark_return_series: pd.Series, n: int=252) -> pd.DataFrame:
+    """
+    Calculates rolling Jensen's alpha, beta, annualized tracking error and
+    annualized information ratio against a benchmark over windows of n
+    aligned observations. Handles NAs like calculate_jensens_alpha.
+
+    Every window statistic is derived from rolling sums of returns, squares
+    and cross-products, so the cost is O(n) in the length of the series
+    rather than a regression per window.
+    """
+
+    # Join series along date index and keep rows where both are present
+    index = return_series.index.union(benchmark_return_series.index)
+    returns = np.asarray(return_series.reindex(index), dtype=float)
+    benchmarks = np.asarray(benchmark_return_series.reindex(index), dtype=float)
+    mask = ~(np.isnan(returns) | np.isnan(benchmarks))
+    index, y, x = index[mask], returns[mask], benchmarks[mask]
+
+    # Center before taking sums of squares for numerical stability, as in
+    # _fit_least_squares. Beta and the active stdev do not depend on it.
+    x_mean, y_mean = x.mean(), y.mean()
+    dx, dy = x - x_mean, y - y_mean
+    active = dy - dx
 
-    # Get the appropriate data structure for scikit learn
-    clean_returns: pd.Series = df[df.columns.values[0]]
-    clean_benchmarks = pd.DataFrame(df[df.columns.values[1]])
+    sums = pd.DataFrame({
+        'x': dx,
+        'y': dy,
+        'xx': dx * dx,
+        'xy': dx * dy,
+        'd': active,
+        'dd': active * active,
+    }, index=index).rolling(n).sum()
 
-    # Fit a linear regression and return the alpha
-    regression = LinearRegression().fit(clean_benchmarks, y=clean_returns)
-    return regression.intercept_
+    # Least squares of y on x within each window
+    beta = (sums['xy'] - sums['x'] * sums['y'] / n) / \
+        (sums['xx'] - sums['x'] ** 2 / n)
+    alpha = (y_mean + sums['y'] / n) - beta * (x_mean + sums['x'] / n)
+
+    entries_per_year = index.shape[0] / get_years_past(sums)
+
+    active_mean = (y_mean - x_mean) + sums['d'] / n
+    active_stdev = np.sqrt((sums['dd'] - sums['d'] ** 2 / n) / (n - 1))
+    tracking_error = active_stdev * np.sqrt(entries_per_year)
+    information_ratio = active_mean / active_stdev * np.sqrt(entries_per_year)
+
+    return pd.DataFrame({
+        'alpha': alpha,
+        'beta': beta,
+        'tracking_error': tracking_error,
+        'information_ratio': information_ratio,
+    })
 
 def calculate_jensens_alpha_v2(return_series: pd.Series) -> float: 
     """
@@ -174,24 +349,170 @@ DRAWDOWN_EVALUATORS: Dict[str, Callable] = {
     'log': lambda price, peak: np.log(peak) - np.log(price),
 }
 
-def calculate_drawdown_series(series: pd.Series, method: str='log') -> pd.Series:
+def _calculate_drawdowns(series: PriceData, method: str) -> np.ndarray:
+    assert method in DRAWDOWN_EVALUATORS, \
+        f'Method "{method}" must by one of {list(DRAWDOWN_EVALUATORS.keys())}'
+
+    evaluator = DRAWDOWN_EVALUATORS[method]
+    values = np.asarray(series, dtype=float)
+    return evaluator(values, np.fmax.accumulate(values, axis=0))
+
+def calculate_drawdown_series(series: PriceData, 
+    method: str='log') -> PriceData:
     """
     Returns the drawdown series
     """
+    return _wrap_like(_calculate_drawdowns(series, method), series)
+
+def calculate_max_drawdown(series: PriceData, 
+    method: str='log') -> MetricValue:
+    """
+    Simply returns the max drawdown as a float, or one per column
+    """
+    drawdowns = _calculate_drawdowns(series, method)
+    return _wrap_reduced(np.nanmax(drawdowns, axis=0), series)
+
+DRAWDOWN_EPISODE_COLUMNS = [
+    'max_drawdown', 
+    'peak_date', 
+    'peak_price', 
+    'trough_date', 
+    'trough_price', 
+    'recovery_date', 
+    'duration',
+]
+
+# Columns of calculate_drawdown_episodes, after the curve for dataframes
+DRAWDOWN_EPISODE_TABLE_COLUMNS = [
+    'start_date', 
+    'peak_date', 
+    'peak_price', 
+    'trough_date', 
+    'trough_price', 
+    'recovery_date', 
+    'max_drawdown', 
+    'duration', 
+    'time_under_water',
+]
+
+def _find_drawdown_episodes(series: PriceData, 
+    method: str) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+    Finds every drawdown episode, i.e. every run of consecutive dates under 
+    the running peak, of every column at once. Returns the column position of 
+    each episode and a table of episodes with DRAWDOWN_EPISODE_TABLE_COLUMNS, 
+    ordered by column then date. 
+
+    The peak of an episode is the first date its peak price was reached and 
+    the recovery is the first date back at or above the peak price, NaT if 
+    the series never recovers. Time under water counts the dates in the run.
+    """
+    evaluator = DRAWDOWN_EVALUATORS[method]
+    index = series.index
+    values = np.asarray(series, dtype=float)
+    values = values.reshape(values.shape[0], -1)
+    n, k = values.shape
+
+    peaks = np.fmax.accumulate(values, axis=0)
+    drawdowns = evaluator(values, peaks)
+
+    # Row at which each running peak was first reached, skipping NaNs
+    previous_peaks = np.full_like(peaks, -np.inf)
+    previous_peaks[1:] = np.where(np.isnan(peaks[:-1]), -np.inf, peaks[:-1])
+    new_highs = values > previous_peaks
+    rows = np.arange(n)[:, np.newaxis]
+    peak_rows = np.maximum.accumulate(np.where(new_highs, rows, 0), axis=0)
+
+    # Run-length encode the underwater masks of all columns as one flat array, 
+    # padded at both ends of each column so runs never cross columns
+    underwater = np.zeros((k, n + 2), dtype=bool)
+    underwater[:, 1:-1] = (drawdowns > 0).T
+    edges = np.diff(underwater.ravel().astype(np.int8))
+    starts = np.flatnonzero(edges == 1) + 1
+    stops = np.flatnonzero(edges == -1) + 1
+    columns = starts // (n + 2)
+    start_rows = starts % (n + 2) - 1
+    stop_rows = stops % (n + 2) - 1
+
+    if starts.shape[0] == 0:
+        return columns, pd.DataFrame(columns=DRAWDOWN_EPISODE_TABLE_COLUMNS)
+
+    # Deepest point of each episode, first occurrence on ties
+    flat_drawdowns = np.append(drawdowns.T.ravel(), np.nan)
+    start_at = columns * n + start_rows
+    stop_at = columns * n + stop_rows
+    bounds = np.column_stack([start_at, stop_at]).ravel()
+    depths = np.fmax.reduceat(flat_drawdowns, bounds)[::2]
+
+    is_underwater = underwater[:, 1:-1].ravel()
+    marks = np.zeros(n * k, dtype=np.int64)
+    marks[start_at] = 1
+    episode_ids = np.cumsum(marks) - 1
+    is_trough = is_underwater & \
+        (flat_drawdowns[:-1] == depths[np.maximum(episode_ids, 0)])
+    candidates = np.flatnonzero(is_trough)
+    _, first = np.unique(episode_ids[candidates], return_index=True)
+    trough_rows = candidates[first] - columns * n
+
+    peak_rows = peak_rows[start_rows - 1, columns]
+    recovered = stop_rows < n
+    recovery_dates = pd.DatetimeIndex(np.where(
+        recovered, 
+        index.values[np.minimum(stop_rows, n - 1)], 
+        np.datetime64('NaT'),
+    ))
+
+    episodes = pd.DataFrame({
+        'start_date': index[start_rows],
+        'peak_date': index[peak_rows],
+        'peak_price': peaks[start_rows - 1, columns],
+        'trough_date': index[trough_rows],
+        'trough_price': values[trough_rows, columns],
+        'recovery_date': recovery_dates,
+        'max_drawdown': depths,
+    })
+    episodes['duration'] = episodes['recovery_date'] - episodes['peak_date']
+    episodes['time_under_water'] = stop_rows - start_rows
+    return columns, episodes
+
+def _calculate_drawdown_episodes(series: pd.Series, 
+    method: str='log') -> pd.DataFrame:
+    """
+    Every drawdown episode of a single series in chronological order, with 
+    DRAWDOWN_EPISODE_COLUMNS
+    """
+    _, episodes = _find_drawdown_episodes(series, method)
+    return episodes[DRAWDOWN_EPISODE_COLUMNS]
+
+def calculate_drawdown_episodes(series: PriceData, 
+    method: str='log') -> pd.DataFrame:
+    """
+    Returns a table of every drawdown episode, one row each in chronological 
+    order. For a dataframe, all curves are computed at once and the table 
+    leads with a 'curve' column naming the column of each episode.
+
+    start_date is the first date under water, duration runs from the peak to 
+    the recovery, and time_under_water counts the dates under water. 
+    recovery_date and duration are NaT for an episode that has not recovered.
+    """
     assert method in DRAWDOWN_EVALUATORS, \
         f'Method "{method}" must by one of {list(DRAWDOWN_EVALUATORS.keys())}'
 
-    evaluator = DRAWDOWN_EVALUATORS[method]
-    return evaluator(series, series.cummax())
+    columns, episodes = _find_drawdown_episodes(series, method)
+    if isinstance(series, pd.DataFrame):
+        episodes.insert(0, 'curve', series.columns[columns])
+    return episodes
 
-def calculate_max_drawdown(series: pd.Series, method: str='log') -> float:
+def calculate_time_under_water(series: PriceData, 
+    method: str='log') -> MetricValue:
     """
-    Simply returns the max drawdown as a float
+    Fraction of dates spent below the running peak
     """
-    return calculate_drawdown_series(series, method).max()
+    drawdowns = _calculate_drawdowns(series, method)
+    return _wrap_reduced((drawdowns > 0).mean(axis=0), series)
 
 def calculate_max_drawdown_with_metadata(series: pd.Series, 
-    method: str='log') -> Dict[str, Any]:
+    method: str='log', top_n: int=None) -> Dict[str, Any]:
     """
     Calculates max_drawndown and stores metadata about when and where. Returns 
     a dictionary of the form 
@@ -201,52 +522,50 @@ def calculate_max_drawdown_with_metadata(series: pd.Series,
             'peak_price': float,
             'trough_date': pd.Timestamp,
             'trough_price': float,
+            'recovery_date': pd.Timestamp,
+            'duration': pd.Timedelta,
         }
+
+    recovery_date and duration, from peak to recovery, are NaT if the series 
+    never recovers. If top_n is given, also includes 'top_drawdowns', a 
+    dataframe of the top_n deepest non-overlapping drawdowns with the same 
+    columns, deepest first.
     """
 
     assert method in DRAWDOWN_EVALUATORS, \
         f'Method "{method}" must by one of {list(DRAWDOWN_EVALUATORS.keys())}'
 
-    evaluator = DRAWDOWN_EVALUATORS[method]
-
-    max_drawdown = 0
-    local_peak_date = peak_date = trough_date = series.index[0]
-    local_peak_price = peak_price = trough_price = series.iloc[0]
-
-    for date, price in series.iteritems():
+    episodes = _calculate_drawdown_episodes(series, method)
 
-        # Keep track of the rolling max
-        if price > local_peak_price:
-            local_peak_date = date
-            local_peak_price = price
+    # Earliest episode wins ties, like a forward scan would
+    ranked = episodes.sort_values('max_drawdown', ascending=False, 
+        kind='stable').reset_index(drop=True)
 
-        # Compute the drawdown
-        drawdown = evaluator(price, local_peak_price)
-
-        # Store new max drawdown values
-        if drawdown > max_drawdown:
-            max_drawdown = drawdown
-
-            peak_date = local_peak_date
-            peak_price = local_peak_price
+    if ranked.empty:
+        result = {
+            'max_drawdown': 0,
+            'peak_date': series.index[0],
+            'peak_price': series.iloc[0],
+            'trough_date': series.index[0],
+            'trough_price': series.iloc[0],
+            'recovery_date': pd.NaT,
+            'duration': pd.NaT,
+        }
+    else:
+        result = ranked.iloc[0].to_dict()
 
-            trough_date = date
-            trough_price = price
+    if top_n is not None:
+        result['top_drawdowns'] = ranked.iloc[:top_n]
 
-    return {
-        'max_drawdown': max_drawdown,
-        'peak_date': peak_date,
-        'peak_price': peak_price,
-        'trough_date': trough_date,
-        'trough_price': trough_price
-    }
+    return result
 
-def calculate_log_max_drawdown_ratio(series: pd.Series) -> float:
+def calculate_log_max_drawdown_ratio(series: PriceData) -> MetricValue:
     log_drawdown = calculate_max_drawdown(series, method='log')
     log_return = np.log(series.iloc[-1]) - np.log(series.iloc[0])
     return log_return - log_drawdown
 
-def calculate_calmar_ratio(series: pd.Series, years_past: int=3) -> float:
+def calculate_calmar_ratio(series: PriceData, 
+    years_past: int=3) -> MetricValue:
     """
     Return the percent max drawdown ratio over the past three years, otherwise 
     known as the Calmar Ratio
@@ -263,3 +582,813 @@ def calculate_calmar_ratio(series: pd.Series, years_past: int=3) -> float:
     return cagr / percent_drawdown
 
 
+
+
+def _as_column(values: np.ndarray, like: np.ndarray) -> np.ndarray:
+    """
+    Reshape a 1-D array along the date axis to broadcast against like
+    """
+    return values.reshape(-1, *([1] * (like.ndim - 1)))
+
+
+def _window_years(index: pd.DatetimeIndex, n: int) -> np.ndarray:
+    """
+    Years spanned by every trailing window of n dates, or by every expanding 
+    window from the first date when n is None. NaN for incomplete windows.
+    """
+    years = np.full(len(index), np.nan)
+    if n is None:
+        years[:] = _years_between(index[0], index)
+    else:
+        years[n-1:] = _years_between(index[:len(index)-n+1], index[n-1:])
+    return np.where(years > 0, years, np.nan)
+
+
+def _window_cagr(values: np.ndarray, years: np.ndarray, n: int) -> np.ndarray:
+    """
+    CAGR of every trailing window of n values, or every expanding window when 
+    n is None, given the years each window spans
+    """
+    start = np.empty_like(values)
+    if n is None:
+        start[:] = values[0]
+    else:
+        start[:n-1] = np.nan
+        start[n-1:] = values[:values.shape[0]-n+1]
+    return (values / start) ** (1 / _as_column(years, values)) - 1
+
+
+def _sliding_max_drawdown(values: np.ndarray, n: int) -> np.ndarray:
+    """
+    Largest values[i] - values[j] with i <= j inside every trailing window of 
+    n rows, column-wise. NaN for the first n - 1 rows and for windows holding 
+    a NaN.
+
+    Rows are cut into blocks of n, so every window is the tail of one block 
+    followed by the head of the next. Running max, min and drawdown from the 
+    block edges inward answer each window in constant time, which is the 
+    van Herk/Gil-Werman form of monotonic-deque window maxima.
+    """
+    length = values.shape[0]
+    flat = values.reshape(length, -1)
+    n_blocks = -(-length // n)
+    padded = np.full((n_blocks * n, flat.shape[1]), np.nan)
+    padded[:length] = flat
+    blocks = padded.reshape(n_blocks, n, -1)
+
+    # Summaries of each block's head, from the block start to each row
+    head_max = np.maximum.accumulate(blocks, axis=1)
+    head_min = np.minimum.accumulate(blocks, axis=1)
+    head_drawdown = np.maximum.accumulate(head_max - blocks, axis=1)
+
+    # Summaries of each block's tail, from each row to the block end
+    reverse = blocks[:, ::-1]
+    tail_max = np.maximum.accumulate(reverse, axis=1)[:, ::-1]
+    tail_min = np.minimum.accumulate(reverse, axis=1)[:, ::-1]
+    tail_drawdown = np.maximum.accumulate(
+        (blocks - tail_min)[:, ::-1], axis=1)[:, ::-1]
+
+    head_min, head_drawdown = (a.reshape(-1, flat.shape[1]) 
+        for a in (head_min, head_drawdown))
+    tail_max, tail_drawdown = (a.reshape(-1, flat.shape[1]) 
+        for a in (tail_max, tail_drawdown))
+
+    end = np.arange(n - 1, length)
+    start = end - n + 1
+    across = np.maximum(
+        np.maximum(tail_drawdown[start], head_drawdown[end]),
+        tail_max[start] - head_min[end])
+
+    # Windows aligned with a block are covered by the head alone
+    aligned = (start % n == 0)[:, np.newaxis]
+    result = np.full_like(flat, np.nan)
+    result[n-1:] = np.where(aligned, head_drawdown[end], across)
+    return result.reshape(values.shape)
+
+
+def calculate_rolling_max_drawdown(series: PriceData, n: int=252, 
+    method: str='log') -> PriceData:
+    """
+    Max drawdown within every trailing window of n prices, in linear time. 
+    Peaks before the window do not count. The first n - 1 values are NaN.
+    """
+    assert method in DRAWDOWN_EVALUATORS, \
+        f'Method "{method}" must by one of {list(DRAWDOWN_EVALUATORS.keys())}'
+    values = np.asarray(series, dtype=float)
+
+    if method == 'dollar':
+        return _wrap_like(_sliding_max_drawdown(values, n), series)
+
+    # Percent drawdown is monotone in log drawdown, so one pass serves both
+    log_drawdown = _sliding_max_drawdown(np.log(values), n)
+    if method == 'log':
+        return _wrap_like(log_drawdown, series)
+    return _wrap_like(-np.expm1(-log_drawdown), series)
+
+
+def calculate_expanding_max_drawdown(series: PriceData, 
+    method: str='log') -> PriceData:
+    """
+    Max drawdown from the start of the series up to each date
+    """
+    drawdowns = _calculate_drawdowns(series, method)
+    return _wrap_like(np.fmax.accumulate(drawdowns, axis=0), series)
+
+
+def _window_sortino_ratio(price_series: PriceData, n: int, 
+    benchmark_rate: float, context: MetricsContext) -> np.ndarray:
+    """
+    Sortino ratio of every trailing window of n prices, or every expanding 
+    window when n is None, from running sums of squared downside returns
+    """
+    values = np.asarray(price_series, dtype=float)
+    years = _window_years(price_series.index, n)
+
+    # The benchmark rate is de-annualized once, at the whole-series frequency
+    entries_per_year = _get_context(price_series, context).entries_per_year
+    adjusted_benchmark_rate = ((1+benchmark_rate) ** (1/entries_per_year)) - 1
+
+    downside = adjusted_benchmark_rate - (_shifted_ratio(values) - 1)
+    downside_squares = np.where(downside > 0, downside ** 2, 0)
+    downside_squares[0] = np.nan
+
+    if n is None:
+        sum_of_squares = np.nancumsum(downside_squares, axis=0)
+        sizes = np.arange(1, values.shape[0] + 1, dtype=float)
+    else:
+        sum_of_squares = pd.DataFrame(downside_squares.reshape(
+            values.shape[0], -1)).rolling(n - 1).sum().values
+        sum_of_squares = sum_of_squares.reshape(values.shape)
+        sizes = np.full(values.shape[0], float(n))
+
+    # Each window of k prices has k - 1 returns, annualized at k per its years
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deviation = np.sqrt(sum_of_squares / _as_column(sizes - 1, values))
+        deviation = deviation * _as_column(np.sqrt(sizes / years), values)
+        cagr = _window_cagr(values, years, n)
+        return (cagr - benchmark_rate) / deviation
+
+
+def calculate_rolling_sortino_ratio(price_series: PriceData, n: int=252, 
+    benchmark_rate: float=0, context: MetricsContext=None) -> PriceData:
+    """
+    Sortino ratio over every trailing window of n prices in linear time. 
+    Matches calculate_sortino_ratio on each window for a zero benchmark rate. 
+    Otherwise the benchmark rate is de-annualized once for the whole series.
+    """
+    assert n >= 2, 'Window must hold at least two prices'
+    ratio = _window_sortino_ratio(price_series, n, benchmark_rate, context)
+    return _wrap_like(ratio, price_series)
+
+
+def calculate_expanding_sortino_ratio(price_series: PriceData, 
+    benchmark_rate: float=0, context: MetricsContext=None) -> PriceData:
+    """
+    Sortino ratio from the start of the series up to each date
+    """
+    ratio = _window_sortino_ratio(price_series, None, benchmark_rate, 
+        context)
+    return _wrap_like(ratio, price_series)
+
+
+def calculate_rolling_calmar_ratio(series: PriceData, 
+    n: int=756) -> PriceData:
+    """
+    CAGR over percent max drawdown within every trailing window of n prices. 
+    The default of 756 is about the three years used by calculate_calmar_ratio.
+    """
+    assert n >= 2, 'Window must hold at least two prices'
+    values = np.asarray(series, dtype=float)
+    cagr = _window_cagr(values, _window_years(series.index, n), n)
+    drawdown = calculate_rolling_max_drawdown(series, n, method='percent')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _wrap_like(cagr / np.asarray(drawdown), series)
+
+
+def calculate_expanding_calmar_ratio(series: PriceData) -> PriceData:
+    """
+    CAGR over percent max drawdown from the start of the series up to each date
+    """
+    values = np.asarray(series, dtype=float)
+    cagr = _window_cagr(values, _window_years(series.index, None), None)
+    drawdown = calculate_expanding_max_drawdown(series, method='percent')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _wrap_like(cagr / np.asarray(drawdown), series)
+
+
+BOOTSTRAP_METRICS = ['sharpe_ratio', 'sortino_ratio', 'cagr']
+
+def _draw_bootstrap_blocks(rng: np.random.Generator, n_samples: int, 
+    length: int, block_size: int, 
+    method: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Draws the start index and length of every block of n_samples resamples of 
+    a series of the given length, as two (n_samples, n_blocks) matrices. 
+    Blocks wrap around the end of the series and the last block of each 
+    resample is cut so that lengths sum to the series length.
+    """
+    if method == 'block':
+        n_blocks = -(-length // block_size)
+        lengths = np.full((n_samples, n_blocks), block_size)
+    else:
+        # Stationary bootstrap, geometric block lengths with the given mean. 
+        # Five standard deviations of headroom make top-ups rare.
+        expected = length / block_size
+        n_blocks = int(np.ceil(expected + 5 * np.sqrt(expected))) + 1
+        lengths = rng.geometric(1 / block_size, size=(n_samples, n_blocks))
+        short = lengths.sum(axis=1) < length
+        while short.any():
+            extra = np.zeros((n_samples, n_blocks), dtype=lengths.dtype)
+            extra[short] = rng.geometric(1 / block_size, 
+                size=(short.sum(), n_blocks))
+            lengths = np.concatenate([lengths, extra], axis=1)
+            short = lengths.sum(axis=1) < length
+
+    starts = rng.integers(0, length, size=lengths.shape)
+    ends = np.minimum(np.cumsum(lengths, axis=1), length)
+    lengths = np.diff(ends, axis=1, prepend=0)
+    return starts, lengths
+
+
+def calculate_bootstrap_replicas(price_series: pd.Series, 
+    n_samples: int=10000, block_size: int=20, method: str='stationary', 
+    benchmark_rate: float=0, random_state: Any=None, 
+    chunk_size: int=None, context: MetricsContext=None) -> pd.DataFrame:
+    """
+    Resamples the return series of price_series n_samples times with a block 
+    or stationary bootstrap and returns the Sharpe ratio, Sortino ratio and 
+    CAGR of every resample, one row each.
+
+    Blocks are summed from prefix sums of the returns, so the cost grows with 
+    the number of blocks rather than the number of days. random_state is a 
+    seed or a np.random.Generator. chunk_size bounds how many resamples are 
+    drawn at once.
+    """
+    assert method in ('block', 'stationary'), \
+        f'Method "{method}" must by one of [\'block\', \'stationary\']'
+
+    rng = np.random.default_rng(random_state)
+    returns = calculate_return_series(price_series).dropna().values
+    length = returns.shape[0]
+
+    # Match the annualization of the metrics on the original series, and the 
+    # zero threshold calculate_sortino_ratio uses for downside deviation
+    context = _get_context(price_series, context)
+    years_past = context.years_past
+    entries_per_year = context.entries_per_year
+    downside = np.maximum(-returns, 0)
+
+    # Prefix sums over the series repeated twice let blocks wrap around
+    terms = [np.log1p(returns), returns, returns ** 2, downside ** 2]
+    prefixes = [np.concatenate([[0], np.cumsum(np.tile(term, 2))]) 
+        for term in terms]
+
+    chunk_size = chunk_size or n_samples
+    sums = np.empty((len(terms), n_samples))
+    for begin in range(0, n_samples, chunk_size):
+        size = min(chunk_size, n_samples - begin)
+        starts, lengths = _draw_bootstrap_blocks(
+            rng, size, length, block_size, method)
+        ends = starts + lengths
+        for i, prefix in enumerate(prefixes):
+            block_sums = np.take(prefix, ends) - np.take(prefix, starts)
+            sums[i, begin:begin+size] = block_sums.sum(axis=1)
+
+    log_growth, total, total_of_squares, downside_squares = sums
+
+    cagr = np.exp(log_growth / years_past) - 1
+    variance = (total_of_squares - total ** 2 / length) / (length - 1)
+    volatility = np.sqrt(np.maximum(variance, 0) * entries_per_year)
+    downside_deviation = np.sqrt(downside_squares / length * entries_per_year)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pd.DataFrame({
+            'sharpe_ratio': (cagr - benchmark_rate) / volatility,
+            'sortino_ratio': (cagr - benchmark_rate) / downside_deviation,
+            'cagr': cagr,
+        }, columns=BOOTSTRAP_METRICS)
+
+
+def calculate_bootstrap_confidence_intervals(price_series: pd.Series, 
+    confidence: float=0.95, **bootstrap_kwargs) -> pd.DataFrame:
+    """
+    Percentile bootstrap confidence intervals for the Sharpe ratio, Sortino 
+    ratio and CAGR of price_series. Returns a dataframe indexed by metric with 
+    columns estimate, lower and upper. Keyword arguments are passed to 
+    calculate_bootstrap_replicas.
+    """
+    replicas = calculate_bootstrap_replicas(price_series, **bootstrap_kwargs)
+    benchmark_rate = bootstrap_kwargs.get('benchmark_rate', 0)
+    context = _get_context(price_series, bootstrap_kwargs.get('context'))
+
+    tail = (1 - confidence) / 2
+    bounds = replicas.quantile([tail, 1 - tail]).T
+    bounds.columns = ['lower', 'upper']
+    bounds.insert(0, 'estimate', [
+        calculate_sharpe_ratio(price_series, benchmark_rate, context),
+        calculate_sortino_ratio(price_series, benchmark_rate, context),
+        calculate_cagr(price_series, context),
+    ])
+    return bounds
+
+
+def _tail_size(n: int, confidence: float) -> int:
+    """
+    Number of worst returns out of n beyond the given confidence level
+    """
+    return max(1, int(np.ceil(round((1 - confidence) * n, 10))))
+
+
+def calculate_value_at_risk(return_series: PriceData, 
+    confidence: float=0.95) -> MetricValue:
+    """
+    Historical value at risk, the loss of the worst return out of the 
+    (1 - confidence) fraction of worst returns, as a positive number. Ignores 
+    NaNs.
+    """
+    var, _ = _calculate_tail_risk(return_series, confidence)
+    return var
+
+
+def calculate_expected_shortfall(return_series: PriceData, 
+    confidence: float=0.95) -> MetricValue:
+    """
+    Historical expected shortfall or CVaR, the average loss of the 
+    (1 - confidence) fraction of worst returns, as a positive number. Ignores 
+    NaNs.
+    """
+    _, cvar = _calculate_tail_risk(return_series, confidence)
+    return cvar
+
+
+def _calculate_tail_risk(return_series: PriceData, 
+    confidence: float) -> Tuple[MetricValue, MetricValue]:
+    values = np.asarray(return_series, dtype=float)
+    flat = np.sort(values.reshape(values.shape[0], -1), axis=0)
+
+    # NaNs sort last, so each column's tail starts at the top
+    valid = (~np.isnan(flat)).sum(axis=0)
+    tail = np.array([_tail_size(v, confidence) for v in valid])
+    columns = np.arange(flat.shape[1])
+    tail_sums = np.nancumsum(flat, axis=0)[tail - 1, columns]
+
+    var = np.where(valid > 0, -flat[tail - 1, columns], np.nan)
+    cvar = np.where(valid > 0, -tail_sums / tail, np.nan)
+    shape = values.shape[1:]
+    return (_wrap_reduced(var.reshape(shape), return_series), 
+        _wrap_reduced(cvar.reshape(shape), return_series))
+
+
+def calculate_rolling_tail_risk(return_series: PriceData, n: int=252, 
+    confidence: float=0.95, 
+    chunk_size: int=2**22) -> Tuple[PriceData, PriceData]:
+    """
+    Rolling historical value at risk and expected shortfall over every 
+    trailing window of n returns, as positive losses. Windows holding a NaN 
+    and the first n - 1 rows are NaN.
+
+    Each window is partitioned around its tail order statistic instead of 
+    sorted, which also leaves the tail in front for the shortfall. Windows 
+    are processed in batches of about chunk_size values to bound memory.
+    """
+    values = np.asarray(return_series, dtype=float)
+    flat = values.reshape(values.shape[0], -1)
+    length, width = flat.shape
+    tail = _tail_size(n, confidence)
+
+    var = np.full_like(flat, np.nan)
+    cvar = np.full_like(flat, np.nan)
+    if length >= n:
+        # Count NaNs per window from a running count rather than per window
+        nan_counts = np.cumsum(np.isnan(flat), axis=0)
+        nan_counts = np.vstack([np.zeros((1, width)), nan_counts])
+        window_nans = nan_counts[n:] - nan_counts[:-n]
+
+        windows = np.lib.stride_tricks.sliding_window_view(flat, n, axis=0)
+        step = max(1, chunk_size // (n * width))
+        for begin in range(0, windows.shape[0], step):
+            batch = np.partition(windows[begin:begin+step], tail - 1, axis=-1)
+            has_nan = window_nans[begin:begin+step] > 0
+            rows = slice(begin + n - 1, begin + n - 1 + batch.shape[0])
+            var[rows] = np.where(has_nan, np.nan, -batch[..., tail - 1])
+            cvar[rows] = np.where(has_nan, np.nan, 
+                -batch[..., :tail].mean(axis=-1))
+
+    return (_wrap_like(var.reshape(values.shape), return_series), 
+        _wrap_like(cvar.reshape(values.shape), return_series))
+
+
+def calculate_rolling_value_at_risk(return_series: PriceData, n: int=252, 
+    confidence: float=0.95) -> PriceData:
+    """
+    Rolling historical value at risk, see calculate_rolling_tail_risk
+    """
+    var, _ = calculate_rolling_tail_risk(return_series, n, confidence)
+    return var
+
+
+def calculate_rolling_expected_shortfall(return_series: PriceData, 
+    n: int=252, confidence: float=0.95) -> PriceData:
+    """
+    Rolling historical expected shortfall, see calculate_rolling_tail_risk
+    """
+    _, cvar = calculate_rolling_tail_risk(return_series, n, confidence)
+    return cvar
+
+
+def _chunk_returns(chunk: pd.Series, last_price: float) -> np.ndarray:
+    """
+    Simple returns of a chunk of prices, continuing from the last price of the 
+    previous chunk, or NaN first if there is none
+    """
+    values = chunk.values.astype(float)
+    previous = np.concatenate([[np.nan if last_price is None else last_price], 
+        values[:-1]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return values / previous - 1
+
+
+def iter_return_series(chunks: Iterable[pd.Series]) -> Iterator[pd.Series]:
+    """
+    Streams calculate_return_series over date-ascending chunks of a price 
+    series, yielding the return series of each chunk
+    """
+    last_price = None
+    for chunk in chunks:
+        if chunk.shape[0] == 0:
+            continue
+        yield pd.Series(_chunk_returns(chunk, last_price), index=chunk.index, 
+            name=chunk.name)
+        last_price = chunk.iloc[-1]
+
+
+def iter_log_return_series(chunks: Iterable[pd.Series]) -> Iterator[pd.Series]:
+    """
+    Same as iter_return_series but with log returns
+    """
+    for return_series in iter_return_series(chunks):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            yield np.log1p(return_series)
+
+
+class MetricAccumulator(object):
+    """
+    Computes a metric of a price series from date-ascending chunks of it, so 
+    the full series is never held in memory. Feed chunks to update() and read 
+    result() at any point, which matches the series-based function applied to 
+    every price seen so far.
+
+    This base class tracks the endpoints shared by every metric, and can be 
+    used on its own to find them.
+    """
+
+    __slots__ = (
+        'first_date', 'first_price', 'last_date', 'last_price', 'n_periods',
+    )
+
+    def __init__(self):
+        self.first_date: pd.Timestamp = None
+        self.first_price: float = None
+        self.last_date: pd.Timestamp = None
+        self.last_price: float = None
+        self.n_periods: int = 0
+
+    def update(self, chunk: pd.Series) -> 'MetricAccumulator':
+        """
+        Consume the next chunk of prices. Returns self for chaining.
+        """
+        if chunk.shape[0] == 0:
+            return self
+
+        if self.first_date is None:
+            self.first_date = chunk.index[0]
+            self.first_price = chunk.iloc[0]
+
+        self._update(chunk, _chunk_returns(chunk, self.last_price))
+
+        self.last_date = chunk.index[-1]
+        self.last_price = chunk.iloc[-1]
+        self.n_periods += chunk.shape[0]
+        return self
+
+    def _update(self, chunk: pd.Series, returns: np.ndarray):
+        pass
+
+    def result(self) -> Any:
+        """
+        The endpoints and number of periods seen so far. Subclasses return 
+        their metric instead.
+        """
+        return {
+            'first_date': self.first_date,
+            'first_price': self.first_price,
+            'last_date': self.last_date,
+            'last_price': self.last_price,
+            'n_periods': self.n_periods,
+        }
+
+    @property
+    def years_past(self) -> float:
+        return _years_between(self.first_date, self.last_date)
+
+    @property
+    def cagr(self) -> float:
+        value_factor = self.last_price / self.first_price
+        return (value_factor ** (1 / self.years_past)) - 1
+
+
+class PercentReturnAccumulator(MetricAccumulator):
+    """
+    Streaming calculate_percent_return
+    """
+
+    __slots__ = ()
+
+    def result(self) -> float:
+        return self.last_price / self.first_price - 1
+
+
+class CAGRAccumulator(MetricAccumulator):
+    """
+    Streaming calculate_cagr
+    """
+
+    __slots__ = ()
+
+    def result(self) -> float:
+        return self.cagr
+
+
+class VolatilityAccumulator(MetricAccumulator):
+    """
+    Streaming calculate_annualized_volatility of the return series of the 
+    prices. Chunk moments are merged with Chan's parallel variance update. 
+    periods_per_year works as in MetricsContext.
+    """
+
+    __slots__ = ('periods_per_year', 'return_count', 'return_mean', 
+        '_return_m2')
+
+    def __init__(self, periods_per_year: float=None):
+        super().__init__()
+        self.periods_per_year = periods_per_year
+        self.return_count: int = 0
+        self.return_mean: float = 0.0
+        self._return_m2: float = 0.0
+
+    def _update(self, chunk: pd.Series, returns: np.ndarray):
+        returns = returns[~np.isnan(returns)]
+        count = returns.shape[0]
+        if count == 0:
+            return
+
+        mean = returns.mean()
+        m2 = ((returns - mean) ** 2).sum()
+
+        total = self.return_count + count
+        delta = mean - self.return_mean
+        self.return_mean += delta * count / total
+        self._return_m2 += m2 + delta ** 2 * self.return_count * count / total
+        self.return_count = total
+
+    @property
+    def entries_per_year(self) -> float:
+        if self.periods_per_year is not None:
+            return self.periods_per_year
+        return self.n_periods / self.years_past
+
+    @property
+    def volatility(self) -> float:
+        stdev = np.sqrt(self._return_m2 / (self.return_count - 1))
+        return stdev * np.sqrt(self.entries_per_year)
+
+    def result(self) -> float:
+        return self.volatility
+
+
+class SharpeRatioAccumulator(VolatilityAccumulator):
+    """
+    Streaming calculate_sharpe_ratio
+    """
+
+    __slots__ = ('benchmark_rate',)
+
+    def __init__(self, benchmark_rate: float=0, periods_per_year: float=None):
+        super().__init__(periods_per_year)
+        self.benchmark_rate = benchmark_rate
+
+    def result(self) -> float:
+        return (self.cagr - self.benchmark_rate) / self.volatility
+
+
+class SortinoRatioAccumulator(VolatilityAccumulator):
+    """
+    Streaming calculate_sortino_ratio, which measures downside deviation 
+    against a zero return
+    """
+
+    __slots__ = ('benchmark_rate', 'downside_sum_of_squares')
+
+    def __init__(self, benchmark_rate: float=0, periods_per_year: float=None):
+        super().__init__(periods_per_year)
+        self.benchmark_rate = benchmark_rate
+        self.downside_sum_of_squares: float = 0.0
+
+    def _update(self, chunk: pd.Series, returns: np.ndarray):
+        super()._update(chunk, returns)
+        downside = -returns
+        self.downside_sum_of_squares += \
+            np.where(downside > 0, downside ** 2, 0).sum()
+
+    @property
+    def downside_deviation(self) -> float:
+        deviation = np.sqrt(self.downside_sum_of_squares / (self.n_periods - 1))
+        return deviation * np.sqrt(self.entries_per_year)
+
+    def result(self) -> float:
+        return (self.cagr - self.benchmark_rate) / self.downside_deviation
+
+
+class MaxDrawdownAccumulator(MetricAccumulator):
+    """
+    Streaming calculate_max_drawdown_with_metadata. Keeps only the running 
+    peak, the episode still under water at the end of the last chunk, and the 
+    deepest episode so far.
+    """
+
+    __slots__ = ('method', 'peak_date', 'peak_price', '_open', '_deepest', 
+        '_deepest_is_open')
+
+    def __init__(self, method: str='log'):
+        super().__init__()
+        assert method in DRAWDOWN_EVALUATORS, \
+            f'Method "{method}" must by one of {list(DRAWDOWN_EVALUATORS)}'
+        self.method = method
+        self.peak_date: pd.Timestamp = None
+        self.peak_price: float = None
+        self._open: Dict[str, Any] = None
+        self._deepest: Dict[str, Any] = None
+        self._deepest_is_open = False
+
+    def _update(self, chunk: pd.Series, returns: np.ndarray):
+        evaluator = DRAWDOWN_EVALUATORS[self.method]
+
+        # Lead with the running peak so episodes are measured against it
+        if self.peak_price is not None:
+            series = pd.Series(
+                np.concatenate([[self.peak_price], chunk.values]), 
+                index=chunk.index.insert(0, self.peak_date))
+        else:
+            series = chunk
+        episodes = _calculate_drawdown_episodes(series, self.method)
+        episodes = episodes.to_dict('records')
+
+        if self._open is not None:
+            if evaluator(chunk.iloc[0], self.peak_price) > 0:
+                # The open episode continues into this chunk
+                episode = episodes[0]
+                if episode['max_drawdown'] <= self._open['max_drawdown']:
+                    for key in ('max_drawdown', 'trough_date', 'trough_price'):
+                        episode[key] = self._open[key]
+            else:
+                # The open episode recovered on the first date of this chunk
+                self._open['recovery_date'] = chunk.index[0]
+                self._open['duration'] = \
+                    chunk.index[0] - self._open['peak_date']
+                if self._deepest_is_open:
+                    self._deepest = self._open
+                self._deepest_is_open = False
+                self._open = None
+
+        for i, episode in enumerate(episodes):
+            continues_open = i == 0 and self._open is not None
+            if continues_open and self._deepest_is_open:
+                self._deepest = episode
+            elif self._deepest is None or \
+                episode['max_drawdown'] > self._deepest['max_drawdown']:
+                self._deepest = episode
+                self._deepest_is_open = False
+
+        self._open = None
+        if episodes and pd.isnull(episodes[-1]['recovery_date']):
+            self._open = episodes[-1]
+            self._deepest_is_open = self._deepest is self._open
+        else:
+            self._deepest_is_open = False
+
+        # First date the new running peak was reached
+        values = chunk.values.astype(float)
+        if not np.isnan(values).all():
+            chunk_peak = np.nanmax(values)
+            if self.peak_price is None or chunk_peak > self.peak_price:
+                self.peak_price = chunk_peak
+                self.peak_date = chunk.index[np.nanargmax(values)]
+
+    def result(self) -> Dict[str, Any]:
+        if self._deepest is None:
+            return {
+                'max_drawdown': 0,
+                'peak_date': self.first_date,
+                'peak_price': self.first_price,
+                'trough_date': self.first_date,
+                'trough_price': self.first_price,
+                'recovery_date': pd.NaT,
+                'duration': pd.NaT,
+            }
+        return dict(self._deepest)
+
+
+def calculate_correlation_matrix(
+    return_series: Union[pd.DataFrame, Dict[str, pd.Series]], 
+    min_periods: int=2, block_size: int=512, 
+    dtype: Any=np.float64) -> pd.DataFrame:
+    """
+    Pearson correlation matrix of many return series, one per column or one 
+    per dictionary entry aligned on dates. Each pair uses the dates where both 
+    are not NaN, as in pd.DataFrame.corr, and pairs with fewer than 
+    min_periods such dates are NaN.
+
+    Pairwise sums are matrix products over blocks of block_size columns, so 
+    thousands of equity curves take a handful of BLAS calls. dtype=np.float32 
+    halves memory and roughly doubles speed at about six digits of precision.
+    """
+    if not isinstance(return_series, pd.DataFrame):
+        return_series = pd.DataFrame(return_series)
+
+    values = np.asarray(return_series, dtype=dtype)
+    valid = ~np.isnan(values)
+    columns = values.shape[1]
+
+    # Centering on column means keeps the one-pass sums well conditioned
+    with np.errstate(invalid='ignore'):
+        means = np.nanmean(values, axis=0)
+    x = np.where(valid, values - means, 0).astype(dtype)
+    corr = np.empty((columns, columns), dtype=dtype)
+
+    if valid.all():
+        # Without NaNs every pair shares the same dates, so standardize once
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = x / np.sqrt((x * x).sum(axis=0))
+        for i in range(0, columns, block_size):
+            for j in range(i, columns, block_size):
+                block = z[:, i:i+block_size].T @ z[:, j:j+block_size]
+                corr[i:i+block_size, j:j+block_size] = block
+                corr[j:j+block_size, i:i+block_size] = block.T
+        if values.shape[0] < min_periods:
+            corr[:] = np.nan
+    else:
+        m = valid.astype(dtype)
+        x2 = x * x
+        for i in range(0, columns, block_size):
+            bi = slice(i, i + block_size)
+            for j in range(i, columns, block_size):
+                bj = slice(j, j + block_size)
+
+                # Sums over the dates both columns of each pair are valid
+                n = m[:, bi].T @ m[:, bj]
+                sum_i = x[:, bi].T @ m[:, bj]
+                sum_j = m[:, bi].T @ x[:, bj]
+                squares_i = x2[:, bi].T @ m[:, bj]
+                squares_j = m[:, bi].T @ x2[:, bj]
+                cross = x[:, bi].T @ x[:, bj]
+
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    cov = cross - sum_i * sum_j / n
+                    var_i = squares_i - sum_i * sum_i / n
+                    var_j = squares_j - sum_j * sum_j / n
+                    block = cov / np.sqrt(var_i * var_j)
+                block[n < min_periods] = np.nan
+
+                corr[bi, bj] = block
+                corr[bj, bi] = block.T
+
+    np.clip(corr, -1, 1, out=corr)
+    return pd.DataFrame(corr, index=return_series.columns, 
+        columns=return_series.columns)
+
+
+def cluster_return_series(correlation: pd.DataFrame, 
+    min_correlation: float=0.9, method: str='average') -> pd.Series:
+    """
+    Hierarchical clustering of strategies from their correlation matrix, see 
+    calculate_correlation_matrix. Clusters are cut where they would merge 
+    below min_correlation, using a distance of one minus correlation. NaN 
+    correlations count as zero.
+
+    Returns cluster labels from 1 indexed like correlation. The number of 
+    distinct labels is the number of effectively distinct strategies.
+    """
+    # Imported here, scipy's clustering is slow to import and rarely needed
+    from scipy.cluster.hierarchy import linkage, fcluster
+    from scipy.spatial.distance import squareform
+
+    if correlation.shape[0] < 2:
+        return pd.Series(1, index=correlation.index)
+
+    distance = 1 - np.nan_to_num(correlation.values.astype(float), nan=0.0)
+    distance = np.clip((distance + distance.T) / 2, 0, 2)
+    np.fill_diagonal(distance, 0)
+
+    links = linkage(squareform(distance, checks=False), method=method)
+    labels = fcluster(links, t=1 - min_correlation, criterion='distance')
+    return pd.Series(labels, index=correlation.index)
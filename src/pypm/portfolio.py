@@ -1,7 +1,13 @@
+import os
+import json
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-from typing import Tuple, List, Dict, Callable, NewType, Any
+from typing import Tuple, List, Dict, Callable, NewType, Any, Iterable
 from collections import OrderedDict, defaultdict
 
 from pypm import metrics, signals, data_io
@@ -11,12 +17,58 @@ Dollars = NewType('Dollars', float)
 
 DATE_FORMAT_STR = '%a %b %d, %Y'
 
+# One row per closed position, see PortfolioHistory.trade_ledger
+TRADE_LEDGER_DTYPE = np.dtype([
+    ('symbol_id', np.int32),
+    ('entry_date', 'datetime64[ns]'),
+    ('exit_date', 'datetime64[ns]'),
+    ('entry_price', np.float64),
+    ('exit_price', np.float64),
+    ('shares', np.float64),
+    ('trade_length', np.int32),
+])
+
+
+# Enough points to be indistinguishable from the full series at typical 
+# figure sizes and resolutions
+PLOT_MAX_POINTS = 4000
+
 
 def _pdate(date: pd.Timestamp):
     """Pretty-print a datetime with just the date"""
     return date.strftime(DATE_FORMAT_STR)
 
 
+def downsample_series(series: pd.Series, 
+    max_points: int=PLOT_MAX_POINTS) -> pd.Series:
+    """
+    Decimate a series for plotting by keeping the minimum and maximum of each 
+    of (max_points - 2) / 2 equally sized buckets, along with the first and 
+    last points, so at most max_points in all. Peaks and troughs of the 
+    series are preserved.
+    """
+    n = series.shape[0]
+    if max_points is None or n <= max_points:
+        return series
+    assert max_points >= 4, 'Need at least 4 points to keep a min and max'
+
+    # Pad with NaN so the values fill a (buckets, bucket_size) matrix
+    n_buckets = (max_points - 2) // 2
+    bucket_size = -(-n // n_buckets)
+    n_buckets = -(-n // bucket_size)
+    padded = np.full(n_buckets * bucket_size, np.nan)
+    padded[:n] = series.values
+    buckets = padded.reshape(n_buckets, bucket_size)
+
+    offsets = np.arange(n_buckets) * bucket_size
+    idx = np.concatenate([
+        [0, n - 1],
+        offsets + np.nanargmin(buckets, axis=1),
+        offsets + np.nanargmax(buckets, axis=1),
+    ])
+    return series.iloc[np.unique(idx)]
+
+
 class Position(object):
     """
     A simple object to hold and manipulate data related to long stock trades.
@@ -26,10 +78,19 @@ class Position(object):
     method is a sell operation.
     """
 
+    __slots__ = (
+        'entry_date', 'entry_price', 'shares', 'symbol', 'exit_date',
+        'exit_price', 'last_date', 'last_price', '_dates', '_prices',
+        '_price_series', '_trade_length', '_track_prices',
+    )
+
     def __init__(self, symbol: Symbol, entry_date: pd.Timestamp,
-                 entry_price: Dollars, shares: int):
+                 entry_price: Dollars, shares: int, track_prices: bool=True):
         """
         Equivalent to buying a certain number of shares of the asset
+
+        If track_prices is False, only the last price is kept and price_series 
+        and value_series are unavailable.
         """
 
         # Recorded on initialization
@@ -51,13 +112,18 @@ class Position(object):
         self.last_date: pd.Timestamp = None
         self.last_price: Dollars = None
 
-        # Updated intermediately
-        self._dict_series: Dict[pd.Timestamp, Dollars] = OrderedDict()
-        self.record_price_update(entry_date, entry_price)
+        # Updated intermediately, in date-ascending order
+        self._track_prices = track_prices
+        self._dates: List[pd.Timestamp] = [] if track_prices else None
+        self._prices: List[Dollars] = [] if track_prices else None
 
-        # Cache control for pd.Series representation
+        # Cache for pd.Series representation, reset on every price update
         self._price_series: pd.Series = None
-        self._needs_update_pd_series: bool = True
+
+        # Number of distinct dates recorded after the entry date
+        self._trade_length: int = -1
+
+        self.record_price_update(entry_date, entry_price)
 
     def exit(self, exit_date, exit_price):
         """
@@ -73,21 +139,29 @@ class Position(object):
         """
         Stateless function to record intermediate prices of existing positions
         """
+        # A repeated date overwrites the last price recorded
+        if date != self.last_date:
+            self._trade_length += 1
+            if self._track_prices:
+                self._dates.append(date)
+                self._prices.append(price)
+        elif self._track_prices:
+            self._prices[-1] = price
+
         self.last_date = date
         self.last_price = price
-        self._dict_series[date] = price
 
         # Invalidate cache on self.price_series
-        self._needs_update_pd_series = True
+        self._price_series = None
 
     @property
     def price_series(self) -> pd.Series:
         """
         Returns cached readonly pd.Series 
         """
-        if self._needs_update_pd_series or self._price_series is None:
-            self._price_series = pd.Series(self._dict_series)
-            self._needs_update_pd_series = False
+        assert self._track_prices, 'Position does not track prices.'
+        if self._price_series is None:
+            self._price_series = pd.Series(self._prices, index=self._dates)
         return self._price_series
 
     @property
@@ -109,7 +183,18 @@ class Position(object):
         Used in calculating the equity curve.
         """
         assert self.is_closed, 'Position must be closed to access this property'
-        return self.shares * self.price_series[:-1]
+        return self.shares * self.price_series.iloc[:-1]
+
+    def iter_value_updates(self) -> Iterable[Tuple[pd.Timestamp, Dollars]]:
+        """
+        Same as value_series, but yields (date, value) pairs without building 
+        a pd.Series
+        """
+        assert self.is_closed, 'Position must be closed to access this method'
+        assert self._track_prices, 'Position does not track prices.'
+        shares = self.shares
+        for date, price in zip(self._dates[:-1], self._prices[:-1]):
+            yield date, shares * price
 
     @property
     def percent_return(self) -> float:
@@ -128,8 +213,22 @@ class Position(object):
         return self.exit_value - self.entry_value
 
     @property
-    def trade_length(self):
-        return len(self._dict_series) - 1
+    def trade_length(self) -> int:
+        return self._trade_length
+
+    @classmethod
+    def from_trade(cls, symbol: Symbol, entry_date: pd.Timestamp, 
+        entry_price: Dollars, exit_date: pd.Timestamp, exit_price: Dollars,
+        shares: float, trade_length: int) -> 'Position':
+        """
+        Materialize a closed position from a trade ledger entry. Intermediate 
+        prices are not retained, so price_series and value_series only carry 
+        the entry and exit prices.
+        """
+        position = cls(symbol, entry_date, entry_price, shares)
+        position.exit(exit_date, exit_price)
+        position._trade_length = trade_length
+        return position
 
     def print_position_summary(self):
         _entry_date = _pdate(self.entry_date)
@@ -160,57 +259,375 @@ class Position(object):
         return hash((self.entry_date, self.symbol))
 
 
+class RunningPerformance(object):
+    """
+    Performance statistics maintained incrementally as a simulation runs, so 
+    they can be queried before PortfolioHistory.finish(). Returns are simple 
+    returns of the equity curve, one per date, with mean and variance kept by 
+    Welford's algorithm.
+    """
+
+    __slots__ = (
+        'last_date', 'equity', 'peak', 'max_drawdown', 'return_count', 
+        'return_mean', '_return_m2', 'number_of_trades', 'winning_trades', 
+        '_previous_state',
+    )
+
+    _STATE_ATTRS = (
+        'equity', 'peak', 'max_drawdown', 'return_count', 'return_mean', 
+        '_return_m2',
+    )
+
+    def __init__(self):
+        self.last_date: pd.Timestamp = None
+        self.equity: Dollars = None
+        self.peak: Dollars = None
+        self.max_drawdown: float = 0.0
+        self.return_count: int = 0
+        self.return_mean: float = 0.0
+        self._return_m2: float = 0.0
+        self.number_of_trades: int = 0
+        self.winning_trades: int = 0
+
+        # State as of the previous date, restored if a date is updated twice
+        self._previous_state: Tuple = None
+
+    def _get_state(self) -> Tuple:
+        return tuple(getattr(self, attr) for attr in self._STATE_ATTRS)
+
+    def _set_state(self, state: Tuple):
+        for attr, value in zip(self._STATE_ATTRS, state):
+            setattr(self, attr, value)
+
+    def update_equity(self, date: pd.Timestamp, equity: Dollars):
+        """
+        Record the equity at the end of a date. A repeated date overwrites the 
+        last equity recorded.
+        """
+        if date == self.last_date:
+            self._set_state(self._previous_state)
+        else:
+            self._previous_state = self._get_state()
+            self.last_date = date
+
+        # Welford update of return mean and variance
+        if self.equity is not None:
+            _return = equity / self.equity - 1
+            self.return_count += 1
+            delta = _return - self.return_mean
+            self.return_mean += delta / self.return_count
+            self._return_m2 += delta * (_return - self.return_mean)
+
+        self.equity = equity
+        self.peak = equity if self.peak is None else max(self.peak, equity)
+        self.max_drawdown = max(self.max_drawdown, self.drawdown)
+
+    def record_trade(self, position: Position):
+        self.number_of_trades += 1
+        if position.exit_price > position.entry_price:
+            self.winning_trades += 1
+
+    @property
+    def drawdown(self) -> float:
+        """
+        Current percent drawdown from the running peak
+        """
+        if self.peak is None:
+            return 0.0
+        return 1 - self.equity / self.peak
+
+    @property
+    def return_variance(self) -> float:
+        if self.return_count < 2:
+            return np.nan
+        return self._return_m2 / (self.return_count - 1)
+
+    @property
+    def return_stdev(self) -> float:
+        return np.sqrt(self.return_variance)
+
+
 class PortfolioHistory(object):
     """
-    Holds Position objects and keeps track of portfolio variables.
+    Keeps track of closed positions and portfolio variables.
     Produces summary statistics.
+
+    Closed positions are stored in a compact trade ledger rather than as 
+    Position objects. Their daily values are folded into a per-date total as 
+    they are recorded, so intermediate prices are not retained.
+
+    With metrics_only=True, positions need not track prices at all. The 
+    marked value of open positions must instead be recorded at the end of 
+    every date with record_portfolio_value, and intermediate dictionaries are 
+    released on finish.
+
+    Recording the marked value also keeps self.running up to date, which can 
+    be queried in the middle of a simulation. Only the end-of-date mark moves 
+    its equity, so cash and open positions are always valued on the same 
+    date. Callers that only use record_cash and add_to_history never record a 
+    marked value, so self.running tracks trades but its equity stays None.
     """
 
-    def __init__(self):
-        # Keep track of positions, recorded in this list after close
-        self.position_history: List[Position] = []
-        self._logged_positions: Set[Position] = set()
+    def __init__(self, metrics_only: bool=False):
+        self.metrics_only = metrics_only
+
+        # Keep track of positions, recorded in the ledger after close
+        self._ledger = np.empty(64, dtype=TRADE_LEDGER_DTYPE)
+        self._ledger_size = 0
+        self._symbols: List[Symbol] = []
+        self._symbol_ids: Dict[Symbol, int] = dict()
+        self._value_by_date: Dict[pd.Timestamp, Dollars] = defaultdict(float)
+
+        # Positions are neither duplicate nor compound, so a symbol's next 
+        # position can't be entered before its last one was exited
+        self._last_exit_by_symbol: Dict[Symbol, pd.Timestamp] = dict()
 
         # Keep track of the last seen date
         self.last_date: pd.Timestamp = pd.Timestamp.min
 
+        # Keep track of performance as the simulation runs
+        self.running = RunningPerformance()
+        self._last_cash: Dollars = None
+
         # Readonly fields
         self._cash_history: Dict[pd.Timestamp, Dollars] = dict()
+        self._dates: pd.DatetimeIndex = None
+        self._cash_array: np.ndarray = None
+        self._value_array: np.ndarray = None
         self._simulation_finished = False
         self._spy: pd.DataFrame = pd.DataFrame()
         self._spy_log_returns: pd.Series = pd.Series()
+        self._performance_metrics: Dict[str, float] = None
 
     def add_to_history(self, position: Position):
-        _log = self._logged_positions
-        assert not position in _log, 'Recorded the same position twice.'
+        symbol = position.symbol
+        _last_exit = self._last_exit_by_symbol.get(symbol, pd.Timestamp.min)
+        assert position.entry_date >= _last_exit, \
+            'Recorded the same position twice.'
         assert position.is_closed, 'Position is not closed.'
-        self._logged_positions.add(position)
-        self.position_history.append(position)
+        self._last_exit_by_symbol[symbol] = position.exit_date
+
+        # Fold daily values into the portfolio value
+        if not self.metrics_only:
+            value_by_date = self._value_by_date
+            for date, value in position.iter_value_updates():
+                value_by_date[date] += value
+
+        self._append_to_ledger(position)
+        self.running.record_trade(position)
         self.last_date = max(self.last_date, position.last_date)
 
-    def record_cash(self, date, cash):
-        self._cash_history[date] = cash
-        self.last_date = max(self.last_date, date)
+    def _get_symbol_id(self, symbol: Symbol) -> int:
+        if symbol not in self._symbol_ids:
+            self._symbol_ids[symbol] = len(self._symbols)
+            self._symbols.append(symbol)
+        return self._symbol_ids[symbol]
+
+    def _append_to_ledger(self, position: Position):
+        # Double capacity when full
+        if self._ledger_size == self._ledger.shape[0]:
+            self._ledger = np.resize(self._ledger, 2 * self._ledger.shape[0])
+
+        self._ledger[self._ledger_size] = (
+            self._get_symbol_id(position.symbol),
+            position.entry_date.to_datetime64(),
+            position.exit_date.to_datetime64(),
+            position.entry_price,
+            position.exit_price,
+            position.shares,
+            position.trade_length,
+        )
+        self._ledger_size += 1
+
+    @property
+    def trade_ledger(self) -> np.ndarray:
+        """
+        Structured array of closed positions in the order they were recorded, 
+        with fields given by TRADE_LEDGER_DTYPE. Symbols are stored as ids into 
+        self.symbols.
+        """
+        return self._ledger[:self._ledger_size]
+
+    @property
+    def symbols(self) -> List[Symbol]:
+        return self._symbols
+
+    def _materialize_position(self, trade: np.void) -> Position:
+        return Position.from_trade(
+            self._symbols[trade['symbol_id']],
+            pd.Timestamp(trade['entry_date']),
+            trade['entry_price'],
+            pd.Timestamp(trade['exit_date']),
+            trade['exit_price'],
+            trade['shares'],
+            int(trade['trade_length']),
+        )
+
+    @property
+    def position_history(self) -> List[Position]:
+        """
+        Closed positions materialized from the trade ledger on demand. Only 
+        entry and exit prices are available on these positions.
+        """
+        return [self._materialize_position(t) for t in self.trade_ledger]
+
+    def _compute_excursions(self, 
+        prices: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Lowest and highest prices of each trade from entry to exit, inclusive, 
+        taken from the simulation's price matrix in one reduction
+        """
+        trades = self.trade_ledger
+        n_dates = prices.shape[0]
+
+        columns = prices.columns.get_indexer(self._symbols)[trades['symbol_id']]
+        entries = prices.index.get_indexer(trades['entry_date'])
+        exits = prices.index.get_indexer(trades['exit_date'])
+        assert (columns >= 0).all() and (entries >= 0).all() and \
+            (exits >= 0).all(), 'Trades are not covered by the price matrix.'
+
+        # Flatten column-major so every trade is a contiguous slice. The NaN 
+        # sentinel keeps slices that end on the last row in bounds.
+        flat_prices = np.append(prices.values.T.astype(float).ravel(), np.nan)
+        starts = columns * n_dates + entries
+        stops = columns * n_dates + exits + 1
+
+        # Even positions of reduceat reduce over [start, stop)
+        bounds = np.column_stack([starts, stops]).ravel()
+        lows = np.fmin.reduceat(flat_prices, bounds)[::2]
+        highs = np.fmax.reduceat(flat_prices, bounds)[::2]
+        return lows, highs
+
+    def compute_trade_table(self, prices: pd.DataFrame=None) -> pd.DataFrame:
+        """
+        Columnar table of closed positions, one row per trade in the order they 
+        were recorded. 
+
+        If the price matrix of the simulation is given, adds the maximum 
+        adverse and favorable excursion of each trade: the lowest and highest 
+        closing price from entry to exit as a percent return on the entry price.
+        """
+        trades = self.trade_ledger
+        symbols = np.array(self._symbols, dtype=object)
+        entry_dates = pd.DatetimeIndex(trades['entry_date'])
+        exit_dates = pd.DatetimeIndex(trades['exit_date'])
+        entry_price = trades['entry_price']
+        exit_price = trades['exit_price']
+        shares = trades['shares']
+
+        table = pd.DataFrame({
+            'symbol': symbols[trades['symbol_id']],
+            'entry_date': entry_dates,
+            'exit_date': exit_dates,
+            'entry_price': entry_price,
+            'exit_price': exit_price,
+            'shares': shares,
+            'holding_days': (exit_dates - entry_dates).days,
+            'trade_length': trades['trade_length'],
+            'percent_return': exit_price / entry_price - 1,
+            'change_in_value': shares * (exit_price - entry_price),
+        })
+
+        if prices is not None and table.shape[0] > 0:
+            lows, highs = self._compute_excursions(prices)
+            table['max_adverse_excursion'] = lows / entry_price - 1
+            table['max_favorable_excursion'] = highs / entry_price - 1
+
+        return table
+
+    def compute_symbol_attribution(self) -> pd.DataFrame:
+        """
+        Number of trades, winning trades, and change in value by symbol, along 
+        with each symbol's share of the total change in value
+        """
+        trades = self.trade_ledger
+        n_symbols = len(self._symbols)
+        symbol_ids = trades['symbol_id']
+        change_in_value = \
+            trades['shares'] * (trades['exit_price'] - trades['entry_price'])
+
+        _count = lambda w=None: np.bincount(symbol_ids, w, minlength=n_symbols)
+        change_by_symbol = _count(change_in_value)
+
+        attribution = pd.DataFrame({
+            'number_of_trades': _count(),
+            'winning_trades': _count(change_in_value > 0).astype(int),
+            'change_in_value': change_by_symbol,
+            'percent_of_change': change_by_symbol / change_in_value.sum(),
+        }, index=pd.Index(self._symbols, name='symbol'))
+
+        return attribution.sort_values('change_in_value', ascending=False)
+
+    def preallocate(self, dates: pd.DatetimeIndex):
+        """
+        Preallocate per-date arrays of cash and portfolio value for a known, 
+        date-ascending index. Cash and portfolio value can then be recorded by 
+        the row ordinal of their date in the index, which avoids hashing 
+        timestamps and sorting on finish.
+        """
+        self._dates = dates
+        self._cash_array = np.full(dates.shape[0], np.nan)
+        self._value_array = np.zeros(dates.shape[0])
+
+    def _get_ordinal(self, date, ordinal: int=None) -> int:
+        return self._dates.get_loc(date) if ordinal is None else ordinal
+
+    def record_cash(self, date, cash, ordinal: int=None):
+        """
+        Record the cash balance on a date. If arrays were preallocated, the 
+        ordinal of the date in the index may also be given to skip a lookup. 
+        The last cash recorded on a date wins.
+
+        Does not update self.running, since open positions are only marked to 
+        the date by record_portfolio_value.
+        """
+        if self._cash_array is None:
+            self._cash_history[date] = cash
+            self.last_date = max(self.last_date, date)
+        else:
+            self._cash_array[self._get_ordinal(date, ordinal)] = cash
+        self._last_cash = cash
+
+    def record_portfolio_value(self, date, value, ordinal: int=None):
+        """
+        Record the marked value of all open positions at the end of a date, 
+        after cash for that date has been recorded. Updates self.running. 
+        Unless metrics_only=True, the portfolio value series is still computed 
+        from closed positions.
+        """
+        if self.metrics_only and self._value_array is None:
+            self._value_by_date[date] = value
+            self.last_date = max(self.last_date, date)
+        elif self.metrics_only:
+            self._value_array[self._get_ordinal(date, ordinal)] = value
+        self.running.update_equity(date, self._last_cash + value)
 
     @staticmethod
     def _as_oseries(d: Dict[pd.Timestamp, Any]) -> pd.Series:
         return pd.Series(d).sort_index()
 
     def _compute_cash_series(self):
-        self._cash_series = self._as_oseries(self._cash_history)
+        if self._cash_array is None:
+            self._cash_series = self._as_oseries(self._cash_history)
+        else:
+            recorded = ~np.isnan(self._cash_array)
+            cash = self._cash_array[recorded]
+            self._cash_series = pd.Series(cash, index=self._dates[recorded])
+        self.last_date = max(self.last_date, self._cash_series.index[-1])
 
     @property
     def cash_series(self) -> pd.Series:
         return self._cash_series
 
     def _compute_portfolio_value_series(self):
-        value_by_date = defaultdict(float)
-        last_date = self.last_date
+        if self.metrics_only and self._value_array is not None:
+            recorded = ~np.isnan(self._cash_array)
+            value = self._value_array[recorded]
+            self._portfolio_value_series = \
+                pd.Series(value, index=self._dates[recorded])
+            return
 
-        # Add up value of assets
-        for position in self.position_history:
-            for date, value in position.value_series.items():
-                value_by_date[date] += value
+        value_by_date = self._value_by_date
 
         # Make sure all dates in cash_series are present
         for date in self.cash_series.index:
@@ -255,14 +672,113 @@ class PortfolioHistory(object):
         self._compute_portfolio_value_series()
         self._compute_equity_series()
         self._compute_log_return_series()
+        self._compute_trade_series()
         self._assert_finished()
 
+        # Intermediate dictionaries are redundant with the computed series
+        if self.metrics_only:
+            self._cash_history = None
+            self._value_by_date = None
+            self._cash_array = None
+            self._value_array = None
+            self._last_exit_by_symbol = None
+
+    def _compute_trade_series(self):
+        """
+        Compute readonly values that follow from the trade ledger
+        """
+        self._compute_position_ordinals()
+        self._compute_active_positions_series()
+        self._compute_exposure_series()
+        self._compute_turnover_series()
+
+    def _compute_position_ordinals(self):
+        """
+        Map entry and exit dates of each position to row ordinals of the 
+        simulation's date index
+        """
+        dates = self.cash_series.index
+        trades = self.trade_ledger
+        self._entry_ordinals = dates.searchsorted(trades['entry_date'])
+        self._exit_ordinals = dates.searchsorted(trades['exit_date'])
+
+    def _scatter_by_ordinal(self, ordinals: np.ndarray, 
+        weights: np.ndarray=None) -> np.ndarray:
+        """
+        Sum weights into a per-date array by row ordinal
+        """
+        n = self.cash_series.shape[0]
+        return np.bincount(ordinals, weights=weights, minlength=n)[:n]
+
+    def _cumulate_open_positions(self, weights: np.ndarray=None) -> np.ndarray:
+        """
+        Difference-array cumulative sum of weights over the dates each position 
+        is held, i.e. from its entry date up to but excluding its exit date. 
+        Dollar weights are summed in whole cents, so dates without open 
+        positions come to exactly zero rather than float residue.
+        """
+        if weights is not None:
+            weights = np.rint(weights * 100)
+
+        added = self._scatter_by_ordinal(self._entry_ordinals, weights)
+        removed = self._scatter_by_ordinal(self._exit_ordinals, weights)
+        if weights is None:
+            return np.cumsum(added - removed)
+
+        # Whole cents are exact in int64, convert back to dollars after summing
+        cents = added.astype(np.int64) - removed.astype(np.int64)
+        return np.cumsum(cents) / 100
+
+    def _compute_active_positions_series(self):
+        counts = self._cumulate_open_positions().round().astype(int)
+        self._active_positions_series = \
+            pd.Series(counts, index=self.cash_series.index)
+
+    @property
+    def active_positions_series(self) -> pd.Series:
+        """
+        Number of positions held on each date of the simulation
+        """
+        return self._active_positions_series
+
     def compute_portfolio_size_series(self) -> pd.Series:
-        size_by_date = defaultdict(int)
-        for position in self.position_history:
-            for date in position.value_series.index:
-                size_by_date[date] += 1
-        return self._as_oseries(size_by_date)
+        """
+        Number of positions held, only on dates with at least one position
+        """
+        self._assert_finished()
+        counts = self.active_positions_series
+        return counts[counts > 0]
+
+    def _compute_exposure_series(self):
+        trades = self.trade_ledger
+        entry_values = trades['shares'] * trades['entry_price']
+        exposure = self._cumulate_open_positions(entry_values)
+        index = self.cash_series.index
+        self._exposure_series = pd.Series(exposure, index=index)
+
+    @property
+    def exposure_series(self) -> pd.Series:
+        """
+        Dollars committed to open positions at cost on each date
+        """
+        return self._exposure_series
+
+    def _compute_turnover_series(self):
+        trades = self.trade_ledger
+        entry_values = trades['shares'] * trades['entry_price']
+        exit_values = trades['shares'] * trades['exit_price']
+        turnover = \
+            self._scatter_by_ordinal(self._entry_ordinals, entry_values) + \
+            self._scatter_by_ordinal(self._exit_ordinals, exit_values)
+        index = self.cash_series.index
+        self._turnover_series = pd.Series(turnover, index=index)
+
+    @property
+    def turnover_series(self) -> pd.Series:
+        """
+        Dollar value of shares bought and sold on each date
+        """
+        return self._turnover_series
 
     @property
     def spy(self):
@@ -279,94 +795,254 @@ class PortfolioHistory(object):
             self._spy_log_returns = metrics.calculate_log_return_series(close)
         return self._spy_log_returns
 
+    def compute_rolling_benchmark_statistics(self, 
+        n: int=252) -> pd.DataFrame:
+        """
+        Rolling alpha, beta, tracking error and information ratio of the log 
+        return series against SPY over windows of n days
+        """
+        self._assert_finished()
+        return metrics.calculate_rolling_benchmark_statistics(
+            self.log_return_series,
+            self.spy_log_returns,
+            n,
+        )
+
+    def compute_rolling_tail_risk(self, n: int=252,
+        confidence: float=0.95) -> pd.DataFrame:
+        """
+        Rolling historical value at risk and expected shortfall of the daily
+        returns of the equity curve over windows of n days
+        """
+        self._assert_finished()
+        return_series = metrics.calculate_return_series(self.equity_series)
+        var, cvar = metrics.calculate_rolling_tail_risk(
+            return_series,
+            n,
+            confidence,
+        )
+        return pd.DataFrame({
+            'value_at_risk': var,
+            'expected_shortfall': cvar,
+        })
+
+    def compute_bootstrap_confidence_intervals(self, confidence: float=0.95,
+        **bootstrap_kwargs) -> pd.DataFrame:
+        """
+        Bootstrap confidence intervals for the Sharpe ratio, Sortino ratio
+        and CAGR of the equity curve. See
+        metrics.calculate_bootstrap_replicas for keyword arguments.
+        """
+        self._assert_finished()
+        return metrics.calculate_bootstrap_confidence_intervals(
+            self.equity_series,
+            confidence,
+            **bootstrap_kwargs,
+        )
+
+    _PERFORMANCE_METRICS_PROPS = [
+        'percent_return',
+        'spy_percent_return',
+        'cagr',
+        'volatility',
+        'sharpe_ratio',
+        'spy_cagr',
+        'excess_cagr',
+        'jensens_alpha',
+        'dollar_max_drawdown',
+        'percent_max_drawdown',
+        'log_max_drawdown_ratio',
+        'number_of_trades',
+        'average_active_trades',
+        'final_cash',
+        'final_equity',
+    ]
+
+    PerformancePayload = NewType('PerformancePayload', Dict[str, float])
+
+    def _compute_performance_metrics(self):
+        """
+        Compute every performance metric in a single pass over shared 
+        intermediates. Equivalent to the functions in pypm.metrics, but the 
+        return series, years past, running peak, and benchmark alignment are 
+        each computed only once.
+        """
+        self._assert_finished()
+
+        # Shared intermediates of the equity curve
+        equity = self.equity_series.values
+        first_equity, last_equity = equity[0], equity[-1]
+        context = metrics.MetricsContext(self.equity_series.index)
+        years_past = context.years_past
+        return_series = equity[1:] / equity[:-1] - 1
+        running_peak = np.maximum.accumulate(equity)
+
+        # Shared intermediates of the benchmark
+        spy_close = self.spy['close']
+        spy_years_past = metrics.get_years_past(spy_close)
+        spy_value_factor = spy_close.iloc[-1] / spy_close.iloc[0]
+
+        value_factor = last_equity / first_equity
+        cagr = (value_factor ** (1 / years_past)) - 1
+        spy_cagr = (spy_value_factor ** (1 / spy_years_past)) - 1
+
+        annualizer = context.annualizer
+        volatility = self.log_return_series.std() * annualizer
+        return_volatility = np.std(return_series, ddof=1) * annualizer
+
+        log_return = np.log(last_equity) - np.log(first_equity)
+        log_max_drawdown = np.max(np.log(running_peak) - np.log(equity))
+
+        average_active_trades = self.compute_portfolio_size_series().mean()
+
+        self._performance_metrics = {
+            'percent_return': value_factor - 1,
+            'spy_percent_return': spy_value_factor - 1,
+            'cagr': cagr,
+            'volatility': volatility,
+            'sharpe_ratio': cagr / return_volatility,
+            'spy_cagr': spy_cagr,
+            'excess_cagr': cagr - spy_cagr,
+            'jensens_alpha': metrics.calculate_jensens_alpha(
+                self.log_return_series,
+                self.spy_log_returns,
+            ),
+            'dollar_max_drawdown': np.max(running_peak - equity),
+            'percent_max_drawdown': np.max(1 - equity / running_peak),
+            'log_max_drawdown_ratio': log_return - log_max_drawdown,
+            'number_of_trades': self._ledger_size,
+            'average_active_trades': average_active_trades,
+            'final_cash': self.cash_series.iloc[-1],
+            'final_equity': last_equity,
+        }
+
+    @property
+    def performance_metrics(self) -> PerformancePayload:
+        """
+        Returns cached readonly performance metrics
+        """
+        if self._performance_metrics is None:
+            self._compute_performance_metrics()
+        return self._performance_metrics
+
     @property
     def percent_return(self):
-        return metrics.calculate_percent_return(self.equity_series)
+        return self.performance_metrics['percent_return']
 
     @property
     def spy_percent_return(self):
-        return metrics.calculate_percent_return(self.spy['close'])
+        return self.performance_metrics['spy_percent_return']
 
     @property
     def cagr(self):
-        return metrics.calculate_cagr(self.equity_series)
+        return self.performance_metrics['cagr']
 
     @property
     def volatility(self):
-        return metrics.calculate_annualized_volatility(self.log_return_series)
+        return self.performance_metrics['volatility']
 
     @property
     def sharpe_ratio(self):
-        return metrics.calculate_sharpe_ratio(self.equity_series)
+        return self.performance_metrics['sharpe_ratio']
 
     @property
     def spy_cagr(self):
-        return metrics.calculate_cagr(self.spy['close'])
+        return self.performance_metrics['spy_cagr']
 
     @property
     def excess_cagr(self):
-        return self.cagr - self.spy_cagr
+        return self.performance_metrics['excess_cagr']
 
     @property
     def jensens_alpha(self):
-        return metrics.calculate_jensens_alpha(
-            self.log_return_series,
-            self.spy_log_returns,
-        )
+        return self.performance_metrics['jensens_alpha']
 
     @property
     def dollar_max_drawdown(self):
-        return metrics.calculate_max_drawdown(self.equity_series, 'dollar')
+        return self.performance_metrics['dollar_max_drawdown']
 
     @property
     def percent_max_drawdown(self):
-        return metrics.calculate_max_drawdown(self.equity_series, 'percent')
+        return self.performance_metrics['percent_max_drawdown']
 
     @property
     def log_max_drawdown_ratio(self):
-        return metrics.calculate_log_max_drawdown_ratio(self.equity_series)
+        return self.performance_metrics['log_max_drawdown_ratio']
 
     @property
     def number_of_trades(self):
-        return len(self.position_history)
+        return self.performance_metrics['number_of_trades']
 
     @property
     def average_active_trades(self):
-        return self.compute_portfolio_size_series().mean()
+        return self.performance_metrics['average_active_trades']
 
     @property
     def final_cash(self):
-        self._assert_finished()
-        return self.cash_series[-1]
+        return self.performance_metrics['final_cash']
 
     @property
     def final_equity(self):
+        return self.performance_metrics['final_equity']
+
+    def get_performance_metric_data(self) -> PerformancePayload:
+        props = self._PERFORMANCE_METRICS_PROPS
+        metrics_by_name = self.performance_metrics
+        return {prop: metrics_by_name[prop] for prop in props}
+
+    _SAVED_SERIES = ['cash', 'portfolio_value', 'equity']
+
+    def save(self, path: str):
+        """
+        Save a finished history to a directory of .npy files, one per series 
+        plus the trade ledger, and a JSON file of performance metrics. Series 
+        can be read back with memory mapping through PortfolioHistory.load.
+        """
         self._assert_finished()
-        return self.equity_series[-1]
+        os.makedirs(path, exist_ok=True)
+        _path = lambda name: os.path.join(path, name)
 
-    _PERFORMANCE_METRICS_PROPS = [
-        'percent_return',
-        'spy_percent_return',
-        'cagr',
-        'volatility',
-        'sharpe_ratio',
-        'spy_cagr',
-        'excess_cagr',
-        'jensens_alpha',
-        'dollar_max_drawdown',
-        'percent_max_drawdown',
-        'log_max_drawdown_ratio',
-        'number_of_trades',
-        'average_active_trades',
-        'final_cash',
-        'final_equity',
-    ]
+        np.save(_path('dates.npy'), self.cash_series.index.values)
+        for name in self._SAVED_SERIES:
+            series = getattr(self, f'{name}_series')
+            np.save(_path(f'{name}.npy'), series.values.astype(float))
 
-    PerformancePayload = NewType('PerformancePayload', Dict[str, float])
+        np.save(_path('trade_ledger.npy'), self.trade_ledger)
+        np.save(_path('symbols.npy'), np.array(self._symbols, dtype=str))
 
-    def get_performance_metric_data(self) -> PerformancePayload:
-        props = self._PERFORMANCE_METRICS_PROPS
-        return {prop: getattr(self, prop) for prop in props}
+        with open(_path('performance_metrics.json'), 'w') as f:
+            json.dump(self.get_performance_metric_data(), f, indent=4)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str='r') -> 'PortfolioHistory':
+        """
+        Load a finished history saved with PortfolioHistory.save. By default 
+        series and the trade ledger are memory-mapped rather than read into 
+        memory. Pass mmap_mode=None to read them in full.
+        """
+        _path = lambda name: os.path.join(path, name)
+        _load = lambda name: np.load(_path(name), mmap_mode=mmap_mode)
+
+        history = cls()
+        dates = pd.DatetimeIndex(np.load(_path('dates.npy')))
+        for name in cls._SAVED_SERIES:
+            series = pd.Series(_load(f'{name}.npy'), index=dates)
+            setattr(history, f'_{name}_series', series)
+
+        trade_ledger = _load('trade_ledger.npy')
+        history._ledger = trade_ledger
+        history._ledger_size = trade_ledger.shape[0]
+        history._symbols = np.load(_path('symbols.npy')).tolist()
+        history._symbol_ids = {s: i for i, s in enumerate(history._symbols)}
+        history.last_date = dates[-1]
+
+        with open(_path('performance_metrics.json')) as f:
+            history._performance_metrics = json.load(f)
+
+        history._simulation_finished = True
+        history._compute_log_return_series()
+        history._compute_trade_series()
+        return history
 
     def print_position_summaries(self):
         for position in self.position_history:
@@ -391,48 +1067,59 @@ class PortfolioHistory(object):
 
         print(s)
 
-    def plot(self, show=True) -> plt.Figure:
+    _PLOT_TITLES = ['Equity', 'Cash', 'Portfolio Value']
+
+    def _get_plot_series(self, max_points: int) -> List[pd.Series]:
         """
-        Plots equity, cash and portfolio value curves.
+        Downsampled equity, cash and portfolio value curves
         """
         self._assert_finished()
+        all_series = [
+            self.equity_series, 
+            self.cash_series, 
+            self.portfolio_value_series,
+        ]
+        return [downsample_series(s, max_points) for s in all_series]
+
+    def plot(self, show=True, max_points: int=PLOT_MAX_POINTS) -> plt.Figure:
+        """
+        Plots equity, cash and portfolio value curves. Long curves are 
+        downsampled to at most max_points, or not at all if None.
+        """
+        all_series = self._get_plot_series(max_points)
 
         figure, axes = plt.subplots(nrows=3, ncols=1)
         figure.tight_layout(pad=3.0)
-        axes[0].plot(self.equity_series)
-        axes[0].set_title('Equity')
-        axes[0].grid()
-
-        axes[1].plot(self.cash_series)
-        axes[1].set_title('Cash')
-        axes[1].grid()
-
-        axes[2].plot(self.portfolio_value_series)
-        axes[2].set_title('Portfolio Value')
-        axes[2].grid()
+        for ax, title, series in zip(axes, self._PLOT_TITLES, all_series):
+            ax.plot(series)
+            ax.set_title(title)
+            ax.grid()
 
         if show:
             plt.show()
 
         return figure
 
-    def plot_benchmark_comparison(self, show=True) -> plt.Figure:
+    def plot_benchmark_comparison(self, show=True, 
+        max_points: int=PLOT_MAX_POINTS) -> plt.Figure:
         """
-        Plot comparable investment in the S&P 500.
+        Plot comparable investment in the S&P 500. Long curves are downsampled 
+        to at most max_points, or not at all if None.
         """
         self._assert_finished()
 
         equity_curve = self.equity_series
-        ax = equity_curve.plot()
+        ax = downsample_series(equity_curve, max_points).plot()
 
         spy_closes = self.spy['close']
-        initial_cash = self.cash_series[0]
-        initial_spy = spy_closes[0]
+        initial_cash = self.cash_series.iloc[0]
+        initial_spy = spy_closes.iloc[0]
 
         scaled_spy = spy_closes * (initial_cash / initial_spy)
-        scaled_spy.plot()
+        downsample_series(scaled_spy, max_points).plot()
 
-        baseline = pd.Series(initial_cash, index=equity_curve.index)
+        # A constant only needs its endpoints
+        baseline = pd.Series(initial_cash, index=equity_curve.index[[0, -1]])
         ax = baseline.plot(color='black')
         ax.grid()
 
@@ -440,3 +1127,32 @@ class PortfolioHistory(object):
 
         if show:
             plt.show()
+
+
+def save_plots(histories: Iterable[PortfolioHistory], paths: Iterable[str], 
+    max_points: int=PLOT_MAX_POINTS, **savefig_kwargs):
+    """
+    Headless batch render of the equity, cash and portfolio value curves of 
+    many finished histories, one image file per history. A single figure is 
+    created outside of pyplot and its lines are updated for every history.
+    """
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.subplots(nrows=3, ncols=1)
+    figure.tight_layout(pad=3.0)
+
+    lines = []
+    for ax, title in zip(axes, PortfolioHistory._PLOT_TITLES):
+        line, = ax.plot([], [])
+        ax.xaxis_date()
+        ax.set_title(title)
+        ax.grid()
+        lines.append(line)
+
+    for history, path in zip(histories, paths):
+        all_series = history._get_plot_series(max_points)
+        for ax, line, series in zip(axes, lines, all_series):
+            line.set_data(mdates.date2num(series.index.values), series.values)
+            ax.relim()
+            ax.autoscale_view()
+        figure.savefig(path, **savefig_kwargs)
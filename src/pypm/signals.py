@@ -1,38 +1,88 @@
 import pandas as pd
 import numpy as np
-from pypm.indicators import calculate_macd_oscillator, \
-    calculate_bollinger_bands
 from pypm.data_io import load_eod_data
 
+from typing import Union
 
-def create_macd_signal(series: pd.Series, n1: int=5, n2: int=34) -> pd.Series:
+# Signals are computed on a single price series or on a whole price matrix at 
+# once, a dataframe or 2-D array with one column per symbol. They come back as 
+# int8 in the same shape and type, 1 to buy, -1 to sell and 0 otherwise.
+SignalData = Union[pd.Series, pd.DataFrame, np.ndarray]
+
+
+def _as_matrix(prices: SignalData) -> np.ndarray:
+    values = np.asarray(prices, dtype=float)
+    return values.reshape(values.shape[0], -1)
+
+
+def _rolling(values: np.ndarray, n: int) -> pd.core.window.Rolling:
+    """
+    Rolling windows over every column of a price matrix at once. A single 
+    window is fastest in pandas, see indicators.calculate_moving_statistics 
+    for many windows of the same prices.
+    """
+    return pd.DataFrame(values, copy=False).rolling(n)
+
+
+def _wrap_signal(signal: np.ndarray, prices: SignalData) -> SignalData:
+    signal = signal.astype(np.int8)
+    if isinstance(prices, pd.DataFrame):
+        return pd.DataFrame(signal, index=prices.index, columns=prices.columns)
+    if isinstance(prices, pd.Series):
+        return pd.Series(signal.ravel(), index=prices.index, name=prices.name)
+    return signal.reshape(np.shape(prices))
+
+
+def create_macd_signal(series: SignalData, n1: int=5, 
+    n2: int=34) -> SignalData:
     """
     Create a momentum-based signal based on the MACD crossover principle. 
     Generate a buy signal when the MACD crosses above zero, and a sell signal when
     it crosses below zero.
     """
+    assert n1 < n2, f'n1 must be less than n2'
+
+    # Calculate the macd of every column at once
+    values = _as_matrix(series)
+    short_average = _rolling(values, n1).mean().values
+    long_average = _rolling(values, n2).mean().values
+    signal = calculate_crossover_signal(short_average - long_average, 
+        long_average)
+    return _wrap_signal(signal, series)
+
+
+def calculate_crossover_signal(macd: np.ndarray, 
+    long_average: np.ndarray) -> np.ndarray:
+    """
+    The sign of a 2-D array of MACD values on the periods it changes, 0 
+    otherwise. MACD within rounding of zero, relative to the long moving 
+    average, counts as zero. Used by create_macd_signal.
+    """
 
-    # Calculate the macd and get the signs of the values.
-    macd = calculate_macd_oscillator(series, n1, n2)
-    macd_sign = np.sign(macd)
+    # Equal moving averages differ only by rounding, count them as zero
+    tolerance = 1e-9 * np.abs(long_average)
+    macd_sign = np.where(np.abs(macd) <= tolerance, 0, np.sign(macd))
 
-    # Create a copy shifted by some amount.
-    macd_shifted_sign = macd_sign.shift(1, axis=0)
+    # Create a copy shifted by one period.
+    macd_shifted_sign = np.full_like(macd_sign, np.nan)
+    macd_shifted_sign[1:] = macd_sign[:-1]
 
-    # Multiply the sign by the boolean. This will have the effect of casting
-    # the boolean to an integer (either 0 or 1) and then multiply by the sign
-    # (either -1, 0 or 1).
-    return macd_sign * (macd_sign != macd_shifted_sign)
+    # Keep the sign only where it changed. Undefined MACD gives no signal.
+    changed = macd_sign != macd_shifted_sign
+    return np.where(changed & ~np.isnan(macd_sign), macd_sign, 0)
 
 
-def create_bollinger_band_signal(series: pd.Series, n: int=20) -> pd.Series:
+def create_bollinger_band_signal(series: SignalData, 
+    n: int=20) -> SignalData:
     """
     Create a reversal-based signal based on the upper and lower bands of the 
     Bollinger bands. Generate a buy signal when the price is below the lower 
     band, and a sell signal when the price is above the upper band.
     """
-    bollinger_bands = calculate_bollinger_bands(series, n)
-    sell = series > bollinger_bands['upper']
-    buy = series < bollinger_bands['lower']
-    return (1*buy - 1*sell)
-
+    values = _as_matrix(series)
+    rolling = _rolling(values, n)
+    middle, stdev = rolling.mean().values, rolling.std().values
+    with np.errstate(invalid='ignore'):
+        sell = values > middle + 2 * stdev
+        buy = values < middle - 2 * stdev
+    return _wrap_signal(1*buy - 1*sell, series)
@@ -14,7 +14,8 @@ class SimpleSimulator(object):
     """
 
     def __init__(self, initial_cash: float=10000, max_active_positions: int=5,
-        percent_slippage: float=0.0005, trade_fee: float=1):
+        percent_slippage: float=0.0005, trade_fee: float=1,
+        metrics_only: bool=False):
 
         ### Set simulation parameters
 
@@ -35,8 +36,15 @@ class SimpleSimulator(object):
         # Keep track of live trades
         self.active_positions_by_symbol: Dict[Symbol, Position] = OrderedDict()
 
+        # Only keep what is needed for performance metrics, e.g. for use with
+        # an optimizer. Positions don't keep track of their price histories.
+        self.metrics_only = metrics_only
+
         # Keep track of portfolio history like cash, equity, and positions
-        self.portfolio_history = PortfolioHistory()
+        self.portfolio_history = PortfolioHistory(metrics_only=metrics_only)
+
+        # Row ordinal of the current date, set while simulating
+        self._date_ordinal: int = None
 
     @property
     def active_positions_count(self):
@@ -99,12 +107,14 @@ class SimpleSimulator(object):
         # Spend the cash
         self.cash -= cash_to_spend + self.trade_fee
         assert self.cash >= 0, 'Spent cash you do not have.'
-        self.portfolio_history.record_cash(date, self.cash)   
+        self.portfolio_history.record_cash(
+            date, self.cash, self._date_ordinal)
 
         # Record the position
         positions_by_symbol = self.active_positions_by_symbol
         assert not symbol in positions_by_symbol, 'Symbol already in portfolio.'        
-        position = Position(symbol, date, purchase_price, shares)
+        position = Position(symbol, date, purchase_price, shares,
+            track_prices=not self.metrics_only)
         positions_by_symbol[symbol] = position
 
     def sell_to_close(self, symbol, date, price):
@@ -123,11 +133,21 @@ class SimpleSimulator(object):
         # Receive the cash
         sale_value = position.last_value * (1 - self.percent_slippage)
         self.cash += sale_value
-        self.portfolio_history.record_cash(date, self.cash)
+        self.portfolio_history.record_cash(
+            date, self.cash, self._date_ordinal)
 
         # Record in portfolio history
         self.portfolio_history.add_to_history(position)
         del positions_by_symbol[symbol]
+
+    def record_portfolio_value(self, date):
+        """
+        Mark active positions to their last price and record their total value
+        """
+        positions = self.active_positions_by_symbol.values()
+        value = sum(position.last_value for position in positions)
+        self.portfolio_history.record_portfolio_value(
+            date, value, self._date_ordinal)
     
     @staticmethod
     def _assert_equal_columns(*args: Iterable[pd.DataFrame]):
@@ -164,14 +184,18 @@ class SimpleSimulator(object):
         active_positions_by_symbol = self.active_positions_by_symbol
         max_active_positions = self.max_active_positions
 
+        # Record cash and portfolio value by row ordinal
+        self.portfolio_history.preallocate(df.index)
+
         # Iterating over all dates.
         # itertuples() is significantly faster than iterrows(), it however comes
         # at the cost of not being able index easily. In order to get around this
         # we use an tuple lookup function: "_idx"
-        for row in df.itertuples():
+        for i, row in enumerate(df.itertuples()):
 
             # date index is always first element of tuple row
             date = row[0]
+            self._date_ordinal = i
 
             # Get symbols with valid and tradable data
             symbols: List[str] = [s for s in all_symbols if _all_valid(row, s)]
@@ -222,11 +246,13 @@ class SimpleSimulator(object):
                 position = active_positions_by_symbol[s]
                 position.record_price_update(date, price)
 
-            self.portfolio_history.record_cash(date, self.cash)
+            self.portfolio_history.record_cash(date, self.cash, i)
+            self.record_portfolio_value(date)
 
         # Sell all positions and mark simulation as complete
         for s in self.active_symbols:
             self.sell_to_close(s, date, row[_idx(s, 'price')])
+        self.record_portfolio_value(date)
         self.portfolio_history.finish()
 
 
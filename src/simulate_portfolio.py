@@ -12,11 +12,11 @@ def simulate_portfolio():
 
     # Use the Bollinger Band outer band crossover as a signal
     _bollinger = signals.create_bollinger_band_signal
-    signal = prices.apply(_bollinger, args=(bollinger_n,), axis=0)
+    signal = _bollinger(prices, bollinger_n)
 
     # Use a rolling sharpe ratio approximation as a preference matrix
     _sharpe = metrics.calculate_rolling_sharpe_ratio
-    preference = prices.apply(_sharpe, args=(sharpe_n, ), axis=0)
+    preference = _sharpe(prices, sharpe_n)
 
     # Run the simulator
     simulator = simulation.SimpleSimulator(
@@ -1,7 +1,7 @@
 import pandas as pd
 import numpy as np
 
-from pypm import metrics, signals, data_io, simulation, optimization
+from pypm import metrics, signals, data_io, simulation, optimization, cache
 from pypm.optimization import GridSearchOptimizer
 
 from typing import List, Dict, Tuple, Callable
@@ -15,14 +15,14 @@ def bind_simulator(**sim_kwargs) -> Callable:
     symbols: List[str] = data_io.get_all_symbols()
     prices: pd.DataFrame = data_io.load_eod_matrix(symbols)
 
-    _bollinger: Callable = signals.create_bollinger_band_signal
+    _bollinger: Callable = cache.memoize(signals.create_bollinger_band_signal)
 
     # Bollinger n is constant throughout
     bollinger_n = 20
 
     def _simulate(white_noise_test_id: int) -> Performance:
         
-        signal = prices.apply(_bollinger, args=(bollinger_n,), axis=0)
+        signal = _bollinger(prices, bollinger_n)
 
         # Build a pile of noise in the same shape as the price data
         _noise = np.random.normal(loc=0, scale=1, size=prices.shape)
@@ -39,7 +39,11 @@ def bind_simulator(**sim_kwargs) -> Callable:
 
 if __name__ == '__main__':
 
-    simulate = bind_simulator(initial_cash=10000, max_active_positions=5)
+    simulate = bind_simulator(
+        initial_cash=10000,
+        max_active_positions=5,
+        metrics_only=True,
+    )
 
     optimizer = GridSearchOptimizer(simulate)
     optimizer.optimize(white_noise_test_id=range(1000))